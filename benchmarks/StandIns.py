@@ -0,0 +1,193 @@
+import json
+import re
+from urllib.parse import urlparse, parse_qs
+from src.components.gcp.gdrive.GoogleSheetManager import GoogleSheetManager
+from src.components.immo.ImmoManager import ImmoManager
+from src.components.telegram.TelegramBotManager import TelegramBotManager
+from src.pipelines.process_apartment_data import ApartmentIntegrationPipeline
+
+
+class ReplayResponse:
+
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ReplaySession:
+    """
+    Replaces the requests session of the ImmoManager serving the search pages by their page number
+    """
+
+    def __init__(self, pages):
+        # The pages are serialized upfront so the replay still pays the JSON parsing like a real response
+        self._pages = [json.dumps(page).encode() for page in pages]
+        self.requests = 0
+
+    def post(self, url, **kwargs):
+        self.requests += 1
+        page_number = int(parse_qs(urlparse(url).query).get('pagenumber', ['1'])[0])
+        return ReplayResponse(self._pages[page_number - 1])
+
+    def get(self, url, **kwargs):
+        return self.post(url, **kwargs)
+
+
+class NullTelegramSession:
+
+    def __init__(self):
+        self.requests = 0
+
+    def get(self, url, **kwargs):
+        self.requests += 1
+        return ReplayResponse(b'{"ok": true}')
+
+
+class _Request:
+
+    def __init__(self, function):
+        self._function = function
+
+    def execute(self):
+        return self._function()
+
+
+class InMemorySheetsService:
+    """
+    Minimal in memory version of the spreadsheets().values() resource used by the GoogleSheetManager
+    """
+
+    def __init__(self, rows, first_row=2, first_column='B'):
+        self.grid = {}
+        self.requests = 0
+        # Last used row of every column, so the reads do not scan the whole grid
+        self._last_rows = {}
+        first_column_index = GoogleSheetManager._column_to_index(first_column) - 1
+        for row_offset, row in enumerate(rows):
+            for column_offset, value in enumerate(row):
+                self._set_cell(first_row - 1 + row_offset, first_column_index + column_offset, value)
+
+    def _set_cell(self, row, column, value):
+        self.grid[(row, column)] = value
+        self._last_rows[column] = max(self._last_rows.get(column, -1), row)
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    @staticmethod
+    def _parse_range(sheet_range):
+        match = re.fullmatch(r'(?:.+!)?([A-Z]+)(\d+)(?::([A-Z]+)(\d*))?', sheet_range)
+        start_column, start_row, end_column, end_row = match.groups()
+        end_column = end_column or start_column
+        end_row = int(end_row) if end_row else (int(start_row) if not match.group(3) else 10 ** 9)
+        return (int(start_row) - 1, GoogleSheetManager._column_to_index(start_column) - 1,
+                end_row - 1, GoogleSheetManager._column_to_index(end_column) - 1)
+
+    def _read(self, sheet_range, major_dimension='ROWS'):
+        start_row, start_column, end_row, end_column = self._parse_range(sheet_range)
+        last_row = max((self._last_rows.get(column, -1) for column in range(start_column, end_column + 1)), default=-1)
+        rows = []
+        for row in range(start_row, min(end_row, last_row) + 1):
+            rows.append([self.grid.get((row, column), '') for column in range(start_column, end_column + 1)])
+        if major_dimension == 'COLUMNS':
+            rows = [list(column) for column in zip(*rows)] if rows else []
+        # The API trims the trailing empty cells and lines
+        rows = [self._trim(line) for line in rows]
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    @staticmethod
+    def _trim(line):
+        while line and line[-1] == '':
+            line = line[:-1]
+        return line
+
+    def _write(self, sheet_range, values):
+        start_row, start_column, end_row, end_column = self._parse_range(sheet_range)
+        cells = 0
+        for row_offset, row in enumerate(values):
+            for column_offset, value in enumerate(row):
+                self._set_cell(start_row + row_offset, start_column + column_offset, value)
+                cells += 1
+        return cells
+
+    def get(self, spreadsheetId, range, majorDimension='ROWS', **kwargs):
+        self.requests += 1
+        values = self._read(range, majorDimension)
+        return _Request(lambda: {'range': range, 'values': values} if values else {'range': range})
+
+    def batchGet(self, spreadsheetId, ranges, majorDimension='ROWS', **kwargs):
+        self.requests += 1
+        value_ranges = []
+        for sheet_range in ranges:
+            values = self._read(sheet_range, majorDimension)
+            value_ranges.append({'range': sheet_range, 'values': values} if values else {'range': sheet_range})
+        return _Request(lambda: {'valueRanges': value_ranges})
+
+    def append(self, spreadsheetId, body, **kwargs):
+        self.requests += 1
+        # The range argument shadows the builtin, it is taken from the keyword arguments
+        sheet_range = kwargs['range']
+        sheet_name = sheet_range.split('!')[0] if '!' in sheet_range else 'Sheet1'
+        start_row, start_column, _, _ = self._parse_range(sheet_range)
+        width = max(len(row) for row in body['values'])
+        # The rows go after the last used row of the table
+        last_row = max([start_row - 1] + [self._last_rows.get(column, -1) for column in range(start_column, start_column + width)])
+        cells = sum(self._set_row(last_row + 1 + offset, start_column, row) for offset, row in enumerate(body['values']))
+        updated_range = (f'{sheet_name}!{GoogleSheetManager._index_to_column(start_column + 1)}{last_row + 2}:'
+                         f'{GoogleSheetManager._index_to_column(start_column + width)}{last_row + 1 + len(body["values"])}')
+        return _Request(lambda: {'updates': {'updatedRange': updated_range, 'updatedCells': cells}})
+
+    def _set_row(self, row, start_column, values):
+        for column_offset, value in enumerate(values):
+            self._set_cell(row, start_column + column_offset, value)
+        return len(values)
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        self.requests += 1
+        cells = sum(self._write(data['range'], data['values']) for data in body['data'])
+        return _Request(lambda: {'totalUpdatedCells': cells})
+
+
+class OfflineGoogleSheetManager(GoogleSheetManager):
+    """
+    GoogleSheetManager working against an InMemorySheetsService, no authentication is done
+    """
+
+    def _authenticate(self):
+        self._credentials = None
+
+    def _get_service(self):
+        self._service = self._configuration['service']
+
+
+class OfflineTelegramBotManager(TelegramBotManager):
+
+    def __init__(self, configuration):
+        super().__init__(configuration)
+        self._dispatcher._session = configuration['session']
+
+
+class BenchmarkPipeline(ApartmentIntegrationPipeline):
+    """
+    Pipeline wired to the offline stand-ins, the configuration carries the replayed pages and the sheet service
+    """
+
+    def _create_telegram_bot(self, configuration):
+        return OfflineTelegramBotManager(configuration)
+
+    def _create_sheet_manager(self, configuration):
+        return OfflineGoogleSheetManager(configuration)
+
+    def _create_immo_manager(self, configuration):
+        immo_manager = ImmoManager(configuration)
+        immo_manager._session = configuration['session']
+        return immo_manager
@@ -0,0 +1,116 @@
+import json
+import random
+
+
+class SyntheticData:
+    """
+    Generators of search result pages and sheet rows shaped like the ImmoScout and Google Sheets responses
+    """
+
+    _exchange_ratio = 0.05
+    _wbs_ratio = 0.03
+    _low_pictures_ratio = 0.1
+    _missing_coordinates_ratio = 0.05
+    _quarters = ['Mitte (Mitte)', 'Friedrichshain (Friedrichshain)', 'Kreuzberg (Kreuzberg)', 'Neukölln (Neukölln)',
+                 'Prenzlauer Berg (Prenzlauer Berg)', 'Wedding (Wedding)', 'Moabit (Tiergarten)', 'Pankow (Pankow)']
+
+    @staticmethod
+    def load_page(path):
+        with open(path) as page_file:
+            return json.load(page_file)
+
+    @staticmethod
+    def generate_search_pages(number_of_listings, page_size=20, seed=42, first_id=200000000):
+        """
+        Generates the result pages of a search with the given number of listings
+
+        :param number_of_listings: total listings of the search
+        :param page_size: listings per page
+        :param seed: seed of the random generator so the runs are comparable
+        :param first_id: id of the first listing, the ids are consecutive
+        :return: list with the pages in order
+        """
+        generator = random.Random(seed)
+        number_of_pages = max(1, (number_of_listings + page_size - 1) // page_size)
+        pages = []
+        for page_number in range(1, number_of_pages + 1):
+            first_index = (page_number - 1) * page_size
+            entries = [
+                SyntheticData._generate_entry(generator, first_id + index)
+                for index in range(first_index, min(first_index + page_size, number_of_listings))
+            ]
+            paging = {
+                'pageNumber': page_number,
+                'pageSize': page_size,
+                'numberOfPages': number_of_pages,
+                'numberOfHits': number_of_listings,
+                'numberOfListings': number_of_listings
+            }
+            if page_number < number_of_pages:
+                paging['next'] = {'@xlink.href': f'/Suche/de/berlin/berlin/wohnung-mieten?sorting=2&pagenumber={page_number + 1}'}
+            pages.append({
+                'searchResponseModel': {
+                    'resultlist.resultlist': {
+                        'paging': paging,
+                        'resultlistEntries': [{'resultlistEntry': entries}]
+                    }
+                }
+            })
+        return pages
+
+    @staticmethod
+    def _generate_entry(generator, entry_id):
+        title = 'Helle Wohnung mit Balkon'
+        draw = generator.random()
+        if draw < SyntheticData._exchange_ratio:
+            title = 'Tauschwohnung gegen kleinere Wohnung'
+        elif draw < SyntheticData._exchange_ratio + SyntheticData._wbs_ratio:
+            title = 'Neubau, WBS erforderlich'
+        picture_number = generator.randint(0, 4) if generator.random() < SyntheticData._low_pictures_ratio else generator.randint(5, 20)
+        address = {
+            'street': 'Musterstraße',
+            'houseNumber': str(generator.randint(1, 200)),
+            'postcode': str(generator.randint(10115, 14199)),
+            'city': 'Berlin',
+            'quarter': generator.choice(SyntheticData._quarters)
+        }
+        if generator.random() >= SyntheticData._missing_coordinates_ratio:
+            address['wgs84Coordinate'] = {
+                'latitude': 52.52 + generator.uniform(-0.12, 0.12),
+                'longitude': 13.40 + generator.uniform(-0.2, 0.2)
+            }
+        cold_rent = round(generator.uniform(400, 2500), 2)
+        return {
+            '@id': str(entry_id),
+            '@publishDate': f'2021-09-{generator.randint(1, 28):02d}T{generator.randint(0, 23):02d}:00:00.000+02:00',
+            'resultlist.realEstate': {
+                'title': title,
+                'address': address,
+                'contactDetails': {'firstname': 'Anna', 'lastname': 'Schmidt', 'portraitUrl': 'https://example.org/p.jpg'},
+                'galleryAttachments': {'attachment': [{'@id': str(index)} for index in range(picture_number)]},
+                'price': {'value': cold_rent},
+                'calculatedTotalRent': {'totalRent': {'value': round(cold_rent * 1.25, 2)}},
+                'livingSpace': round(generator.uniform(20, 140), 1),
+                'numberOfRooms': generator.randint(1, 5),
+                'builtInKitchen': generator.random() < 0.6,
+                'balcony': generator.random() < 0.5,
+                'energyEfficiencyClass': generator.choice(['A', 'B', 'C', 'D', 'E'])
+            }
+        }
+
+    @staticmethod
+    def generate_sheet_rows(number_of_rows, header, known_ids=()):
+        """
+        Generates the rows of a sheet that was already loaded, as the Sheets API returns them
+
+        :param number_of_rows: number of rows without the header
+        :param header: the column names, the ids are written on the id column
+        :param known_ids: ids to use first so they overlap with the search results
+        :return: list of rows, the first one is the header
+        """
+        known_ids = list(known_ids)[:number_of_rows]
+        ids = known_ids + [f'old-{index}' for index in range(number_of_rows - len(known_ids))]
+        rows = [list(header)]
+        for entry_id in ids:
+            rows.append(['' if column != 'id' else entry_id for column in header])
+        return rows
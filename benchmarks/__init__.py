@@ -0,0 +1,3 @@
+"""
+Offline benchmarks of the pipeline using recorded and synthetic fixtures
+"""
\ No newline at end of file
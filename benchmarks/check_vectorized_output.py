@@ -0,0 +1,54 @@
+import argparse
+import contextlib
+import io
+import sys
+from benchmarks.StandIns import ReplaySession
+from benchmarks.SyntheticData import SyntheticData
+from src.components.immo.ImmoManager import ImmoManager
+
+
+def get_processed_rows(pages, vectorized):
+    immo_manager = ImmoManager({
+        'first_url': 'https://www.immobilienscout24.de/Suche/de/berlin/berlin/wohnung-mieten?sorting=2',
+        'vectorized': vectorized
+    })
+    immo_manager._session = ReplaySession(pages)
+    with contextlib.redirect_stdout(io.StringIO()):
+        processed_entries = immo_manager.get_processed_search_results()
+    # The timestamp is the processing time, everything else has to be the same value with the same type
+    return {entry_id: {key: repr(value) for key, value in listing.to_dict().items() if key != 'timestamp'}
+            for entry_id, listing in processed_entries.items()}
+
+
+def check_vectorized_output(number_of_listings, page_size):
+    """
+    Processes the same synthetic search with the scalar and the vectorized paths and compares their listings
+
+    :return: the number of listings that differ
+    """
+    pages = SyntheticData.generate_search_pages(number_of_listings, page_size)
+    scalar_rows = get_processed_rows(pages, vectorized=False)
+    vectorized_rows = get_processed_rows(pages, vectorized=True)
+    different_listings = 0
+    for entry_id in scalar_rows.keys() | vectorized_rows.keys():
+        scalar_row, vectorized_row = scalar_rows.get(entry_id), vectorized_rows.get(entry_id)
+        if scalar_row == vectorized_row:
+            continue
+        different_listings += 1
+        if scalar_row is None or vectorized_row is None:
+            print(f'ERROR:: The listing {entry_id} is only processed by one of the paths')
+            continue
+        for key in scalar_row.keys() | vectorized_row.keys():
+            if scalar_row.get(key) != vectorized_row.get(key):
+                print(f'ERROR:: The listing {entry_id} has {key} {scalar_row.get(key)} in the scalar path '
+                      f'and {vectorized_row.get(key)} in the vectorized one')
+    print(f'INFO:: Compared {len(scalar_rows)} listings, {different_listings} differ')
+    return different_listings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that the vectorized processing matches the scalar one')
+    parser.add_argument('--listings', type=int, default=5000)
+    parser.add_argument('--page-size', type=int, default=20)
+    arguments = parser.parse_args()
+    sys.exit(1 if check_vectorized_output(arguments.listings, arguments.page_size) else 0)
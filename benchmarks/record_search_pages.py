@@ -0,0 +1,36 @@
+import argparse
+import json
+import os
+from src.components.immo.ImmoManager import ImmoManager
+
+
+def record_search_pages(search_url, output_directory, max_pages=None):
+    """
+    Records the result pages of a real search so they can be replayed by the benchmarks
+
+    :param search_url: the search url, as used by the ImmoManager
+    :param output_directory: directory where the pages are written as page_0001.json, page_0002.json...
+    :param max_pages: maximum number of pages to record, all of them by default
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    immo_manager = ImmoManager({'first_url': search_url})
+    search_results = immo_manager._get_search_results(search_url)
+    page_number = 1
+    while True:
+        with open(os.path.join(output_directory, f'page_{page_number:04d}.json'), 'w') as page_file:
+            json.dump(search_results, page_file)
+        paging = search_results['searchResponseModel']['resultlist.resultlist']['paging']
+        if 'next' not in paging or (max_pages and page_number >= max_pages):
+            break
+        search_results = immo_manager._get_search_results(immo_manager._base_url + paging['next']['@xlink.href'])
+        page_number += 1
+    print(f'INFO:: Recorded {page_number} pages in {output_directory}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record the result pages of a search for the benchmarks')
+    parser.add_argument('search_url')
+    parser.add_argument('output_directory')
+    parser.add_argument('--max-pages', type=int, default=None)
+    arguments = parser.parse_args()
+    record_search_pages(arguments.search_url, arguments.output_directory, arguments.max_pages)
@@ -0,0 +1,100 @@
+import argparse
+import contextlib
+import glob
+import io
+import os
+import time
+import tracemalloc
+from benchmarks.StandIns import BenchmarkPipeline, InMemorySheetsService, NullTelegramSession, ReplaySession
+from benchmarks.SyntheticData import SyntheticData
+from src.commons.Listing import Listing
+
+
+def load_recorded_pages(directory):
+    pages = [SyntheticData.load_page(path) for path in sorted(glob.glob(os.path.join(directory, '*.json')))]
+    # The recording may be partial, the paging is fixed so the replay ends on the last recorded page
+    for page in pages:
+        page['searchResponseModel']['resultlist.resultlist']['paging']['numberOfPages'] = len(pages)
+    pages[-1]['searchResponseModel']['resultlist.resultlist']['paging'].pop('next', None)
+    return pages
+
+
+def get_sheet_header():
+    # The header is the one the pipeline writes
+    return list(Listing.HEADER)
+
+
+def get_page_ids(pages):
+    for page in pages:
+        for entry in page['searchResponseModel']['resultlist.resultlist']['resultlistEntries'][0]['resultlistEntry']:
+            yield entry['@id']
+
+
+def run_benchmark(arguments):
+    if arguments.recorded_dir:
+        pages = load_recorded_pages(arguments.recorded_dir)
+    else:
+        pages = SyntheticData.generate_search_pages(arguments.listings, arguments.page_size)
+    number_of_listings = sum(1 for _ in get_page_ids(pages))
+    header = get_sheet_header()
+    known_ids = [entry_id for index, entry_id in enumerate(get_page_ids(pages)) if index % 2 == 0]
+    sheet_rows = SyntheticData.generate_sheet_rows(arguments.sheet_rows, header, known_ids) if arguments.sheet_rows else []
+
+    telegram_session = NullTelegramSession()
+    immo_session = ReplaySession(pages)
+    sheets_service = InMemorySheetsService(sheet_rows)
+    configuration = {
+        'sheet_range': 'Listado!B2:Z',
+        'incremental': arguments.incremental,
+        'streaming': arguments.streaming,
+        'GoogleSheetManager': {'service': sheets_service},
+        'ImmoManager': {
+            'first_url': 'https://www.immobilienscout24.de/Suche/de/berlin/berlin/wohnung-mieten?sorting=2',
+            'max_workers': arguments.max_workers,
+            'vectorized': arguments.vectorized,
+            'session': immo_session
+        },
+        'TelegramBotManager': {'bot_token': 'benchmark', 'bot_chat_id': '0', 'chat_ids': '1,2', 'session': telegram_session,
+                               'dispatcher': {'chat_rate': 10 ** 6, 'global_rate': 10 ** 6}}
+    }
+    if arguments.listing_store:
+        configuration['ListingStore'] = {'db_file': ':memory:'}
+
+    pipeline_output = io.StringIO()
+    with contextlib.redirect_stdout(pipeline_output):
+        pipeline = BenchmarkPipeline(configuration)
+        tracemalloc.start()
+        start = time.perf_counter()
+        pipeline.execute()
+        elapsed = time.perf_counter() - start
+        current_memory, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    metrics = pipeline.get_run_metrics()
+    print(f'Listings: {number_of_listings} in {len(pages)} pages, existing sheet rows: {arguments.sheet_rows}')
+    print(f'Total time: {elapsed:.3f} s, throughput: {number_of_listings / elapsed:.0f} listings/s')
+    print(f'Peak memory during execute: {peak_memory / 2 ** 20:.1f} MiB')
+    print('Stages:')
+    for stage, seconds in metrics['stages'].items():
+        print(f'  {stage:<12} {seconds:10.3f} s')
+    print('Counters:')
+    for counter in metrics['counters']:
+        labels = ', '.join(f'{key}={value}' for key, value in counter.items() if key not in ('name', 'value'))
+        print(f'  {counter["name"]:<20} {labels:<12} {counter["value"]}')
+    print(f'Requests: {immo_session.requests} search pages, {sheets_service.requests} sheets, {telegram_session.requests} telegram')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the apartment pipeline offline')
+    parser.add_argument('--listings', type=int, default=10000, help='number of synthetic listings of the search')
+    parser.add_argument('--sheet-rows', type=int, default=5000, help='number of rows already in the sheet')
+    parser.add_argument('--page-size', type=int, default=20)
+    # Without a directory the recorded page shipped in benchmarks/fixtures is replayed
+    parser.add_argument('--recorded-dir', nargs='?', const=os.path.join(os.path.dirname(__file__), 'fixtures'),
+                        default=None, help='directory with recorded pages, see record_search_pages')
+    parser.add_argument('--max-workers', type=int, default=1)
+    parser.add_argument('--vectorized', action='store_true')
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--listing-store', action='store_true')
+    parser.add_argument('--streaming', action='store_true')
+    run_benchmark(parser.parse_args())
@@ -23,6 +23,11 @@ fi
 # Schedule script
 src_folder="$(pwd)/src/"
 main_name="main.py"
+if [ "$RUN_MODE" = "daemon" ]; then
+  main_name="daemon.py"
+elif [ "$RUN_MODE" = "coordinator" ]; then
+  main_name="coordinator.py"
+fi
 script_path="${src_folder}${main_name}"
 echo "The script path is ${script_path}"
 python3 "${script_path}"
@@ -1,8 +1,44 @@
+import datetime
+
+
 class DataManipulationUtils:
 
+    # The distances are kept to the meter
+    DISTANCE_SCALE = 1000
+
     @staticmethod
     def create_indexed_map_from_map_array(data, id_key):
         indexed_data = {}
         for entry in data:
             indexed_data[entry[id_key]] = entry
-        return indexed_data
\ No newline at end of file
+        return indexed_data
+
+    @staticmethod
+    def parse_publish_date(value):
+        """
+        Parses a publish date like 2021-09-12T10:00:00.000+02:00. The offset changes with the daylight saving time,
+        so the dates have to be compared as datetimes and not as strings.
+
+        :param value: the ISO date, a string or a datetime
+        :return: the timezone aware datetime, the dates without offset are taken as UTC, or None if it is not valid
+        """
+        if isinstance(value, datetime.datetime):
+            date = value
+        else:
+            try:
+                # Older Python versions do not accept the Z suffix
+                date = datetime.datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+            except ValueError:
+                return None
+        return date if date.tzinfo is not None else date.replace(tzinfo=datetime.timezone.utc)
+
+    @staticmethod
+    def round_distance(distance):
+        """
+        Rounds a distance in km to the meter, the vectorized processing rounds in the same way so both give the same
+        values even when their trigonometry differs in the last bit
+
+        :param distance: the distance in km
+        :return: the rounded distance
+        """
+        return round(distance * DataManipulationUtils.DISTANCE_SCALE) / DataManipulationUtils.DISTANCE_SCALE
\ No newline at end of file
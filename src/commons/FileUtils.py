@@ -0,0 +1,23 @@
+import os
+import threading
+
+
+class FileUtils:
+
+    @staticmethod
+    def write_file_atomically(path, content):
+        """
+        Writes the file under a temporary name and renames it once complete. Many processes share the token, the
+        discovery document and the caches, the readers must never see a half written file.
+
+        :param path: path of the file
+        :param content: the text to write
+        """
+        temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(temporary_path, 'w') as temporary_file:
+                temporary_file.write(content)
+            os.replace(temporary_path, path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
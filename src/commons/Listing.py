@@ -0,0 +1,97 @@
+from operator import attrgetter
+
+
+class Listing:
+    """
+    Processed listing as it is written into the sheet. The record keeps only the extracted fields in slots, in the
+    explicit column order of HEADER, and nothing of the raw search result. The optional location features go after
+    the columns of HEADER. Listings also behave like read only maps (listing['score'], listing.get('score'), keys),
+    so they can be used wherever a processed entry map was used.
+    """
+
+    HEADER = ('opinion', 'application_state', 'score', 'cold_rent', 'hot_rent', 'size', 'room_number', 'quarter',
+              'distance_center', 'built_in_kitchen', 'have_balcony', 'url', 'number_of_pics', 'energy_efficiency',
+              'maps_url', 'address', 'contact', 'title', 'id', 'publish_date', 'timestamp')
+
+    __slots__ = HEADER + ('location_features',)
+
+    _fields = frozenset(HEADER)
+    _header_getter = attrgetter(*HEADER)
+    # Row builders compiled per sheet header
+    _row_getters = {}
+
+    def __init__(self, score, cold_rent, hot_rent, size, room_number, quarter, distance_center, built_in_kitchen,
+                 have_balcony, url, number_of_pics, energy_efficiency, maps_url, address, contact, title, id,
+                 publish_date, timestamp, opinion='', application_state='Abierto', location_features=None):
+        self.opinion = opinion
+        self.application_state = application_state
+        self.score = score
+        self.cold_rent = cold_rent
+        self.hot_rent = hot_rent
+        self.size = size
+        self.room_number = room_number
+        self.quarter = quarter
+        self.distance_center = distance_center
+        self.built_in_kitchen = built_in_kitchen
+        self.have_balcony = have_balcony
+        self.url = url
+        self.number_of_pics = number_of_pics
+        self.energy_efficiency = energy_efficiency
+        self.maps_url = maps_url
+        self.address = address
+        self.contact = contact
+        self.title = title
+        self.id = id
+        self.publish_date = publish_date
+        self.timestamp = timestamp
+        self.location_features = location_features
+
+    def keys(self):
+        if self.location_features:
+            return list(self.HEADER) + list(self.location_features.keys())
+        return list(self.HEADER)
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            return getattr(self, key)
+        if self.location_features and key in self.location_features:
+            return self.location_features[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._fields or bool(self.location_features and key in self.location_features)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        return {key: self[key] for key in self.keys()}
+
+    def to_row(self, header=None):
+        """
+        :param header: the column names of the sheet, the columns of the listing by default
+        :return: list with the values of the listing in the header order, '' for the unknown columns
+        """
+        if header is None:
+            row = list(self._header_getter(self))
+            if self.location_features:
+                row.extend(self.location_features.values())
+            return row
+        header = tuple(header)
+        row_getter = self._row_getters.get(header)
+        if row_getter is None:
+            row_getter = self._row_getters[header] = self._compile_row_getter(header)
+        return row_getter(self)
+
+    @classmethod
+    def _compile_row_getter(cls, header):
+        if len(header) > 1 and all(column in cls._fields for column in header):
+            getter = attrgetter(*header)
+            return lambda listing: list(getter(listing))
+        return lambda listing: [listing.get(column, '') for column in header]
+
+    def __repr__(self):
+        return f'Listing(id={self.id!r}, score={self.score!r}, hot_rent={self.hot_rent!r}, quarter={self.quarter!r})'
@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MetricsCollector:
+    """
+    Collects the stage timings, counters and observations of a pipeline run. Every run is logged as a structured
+    JSON line and, optionally, the metrics are served in the Prometheus text format. The run values are reset on every
+    run while the counters exposed to Prometheus are cumulative.
+    """
+
+    _namespace = 'immo_sync'
+    _prometheus_port = None
+
+    _configuration = None
+    _lock = None
+    _stages = None
+    _counters = None
+    _observations = None
+    _total_counters = None
+    _last_run = None
+    _server = None
+
+    def __init__(self, configuration):
+        """
+        Constructor using standard a configuation map
+
+        :param configuration:
+        """
+        self._configuration = configuration
+        if 'namespace' in configuration:
+            self._namespace = configuration['namespace']
+        if 'prometheus_port' in configuration:
+            self._prometheus_port = configuration['prometheus_port']
+        self._lock = threading.Lock()
+        self._total_counters = {}
+        self._last_run = {}
+        self.reset()
+        if self._prometheus_port:
+            self.start_http_server(self._prometheus_port)
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+            self._counters = {}
+            self._observations = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._stages[name] = self._stages.get(name, 0) + elapsed
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._total_counters[key] = self._total_counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            summary = self._observations.setdefault(key, {'count': 0, 'sum': 0, 'max': 0})
+            summary['count'] += 1
+            summary['sum'] += value
+            summary['max'] = max(summary['max'], value)
+
+    def get_counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'stages': {name: round(seconds, 6) for name, seconds in self._stages.items()},
+                'counters': [dict(labels, name=name, value=value) for (name, labels), value in self._counters.items()],
+                'observations': [dict(labels, name=name, **summary) for (name, labels), summary in self._observations.items()]
+            }
+
+    def log_json(self):
+        # The last run is kept for the Prometheus endpoint
+        run = self.to_dict()
+        self._last_run = run
+        print(f'METRICS:: {json.dumps(run)}')
+
+    def to_prometheus(self):
+        lines = []
+        run = self._last_run
+        if run:
+            lines.append(f'# TYPE {self._namespace}_stage_seconds gauge')
+            for name, seconds in run['stages'].items():
+                lines.append(f'{self._namespace}_stage_seconds{{stage="{name}"}} {seconds}')
+            for observation in run['observations']:
+                name = observation['name']
+                labels = self._format_labels({key: value for key, value in observation.items()
+                                              if key not in ('name', 'count', 'sum', 'max')})
+                lines.append(f'# TYPE {self._namespace}_{name} summary')
+                lines.append(f'{self._namespace}_{name}_count{labels} {observation["count"]}')
+                lines.append(f'{self._namespace}_{name}_sum{labels} {observation["sum"]}')
+        with self._lock:
+            total_counters = dict(self._total_counters)
+        for name in sorted({name for name, labels in total_counters}):
+            lines.append(f'# TYPE {self._namespace}_{name}_total counter')
+            for (counter_name, labels), value in total_counters.items():
+                if counter_name == name:
+                    lines.append(f'{self._namespace}_{name}_total{self._format_labels(dict(labels))} {value}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{key}="{value}"' for key, value in sorted(labels.items())) + '}'
+
+    def start_http_server(self, port):
+        collector = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = collector.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('', port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print(f'INFO:: Serving the Prometheus metrics on port {port}')
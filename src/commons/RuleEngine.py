@@ -0,0 +1,123 @@
+import operator
+
+
+class RuleEngine:
+    """
+    Declarative rules compiled once into predicates. A rule is a named list of conditions that must all hold, every
+    condition compares one field of the evaluated map with a value, e.g.
+
+        {'field': 'score', 'op': '>', 'value': 400}
+        {'field': 'title', 'op': 'contains', 'value': 'wbs'}
+
+    The field can be a dotted path into nested maps. The conditions shared by many rules are compiled only once, and
+    they are evaluated lazily at most once per evaluated map, so a map is checked in one pass whatever the number of
+    rules. Inside every rule the cheap comparisons go first so the expensive ones are skipped when a cheap one fails.
+    """
+
+    # Operator name: (function, relative cost)
+    _operators = {
+        '==': (operator.eq, 1),
+        '!=': (operator.ne, 1),
+        '>': (operator.gt, 1),
+        '>=': (operator.ge, 1),
+        '<': (operator.lt, 1),
+        '<=': (operator.le, 1),
+        'in': (lambda value, values: value in values, 2),
+        'not_in': (lambda value, values: value not in values, 2),
+        'contains': (lambda value, text: text in str(value).lower(), 3),
+        'not_contains': (lambda value, text: text not in str(value).lower(), 3)
+    }
+
+    _configuration = None
+    _rule_names = None
+    _rules = None
+    _conditions = None
+
+    def __init__(self, configuration):
+        """
+        Constructor using standard a configuation map
+
+        :param configuration: map of rule names to their list of conditions, the declaration order is kept
+        """
+        self._configuration = configuration
+        self._rule_names = []
+        self._rules = []
+        self._conditions = []
+        condition_indexes = {}
+        for rule_name, conditions in configuration.items():
+            rule = []
+            for condition in conditions:
+                key = (condition['field'], condition['op'], repr(condition['value']))
+                if key not in condition_indexes:
+                    condition_indexes[key] = len(self._conditions)
+                    self._conditions.append(self._compile_condition(condition))
+                rule.append(condition_indexes[key])
+            rule.sort(key=lambda index: self._conditions[index][1])
+            self._rule_names.append(rule_name)
+            self._rules.append(rule)
+
+    def _compile_condition(self, condition):
+        if condition['op'] not in self._operators:
+            raise ValueError(f'The operator {condition["op"]} is not supported')
+        function, cost = self._operators[condition['op']]
+        path = condition['field'].split('.')
+        value = condition['value']
+        if condition['op'] in ('contains', 'not_contains'):
+            # The text checks are case insensitive
+            value = str(value).lower()
+        elif condition['op'] in ('in', 'not_in'):
+            value = frozenset(value)
+        # Nested fields need more lookups
+        cost += len(path) - 1
+
+        def get_value(values):
+            # Any map like value works, e.g. the Listing records
+            for key in path:
+                try:
+                    values = values[key]
+                except (KeyError, TypeError, IndexError):
+                    return None
+            return values
+
+        def predicate(values):
+            field_value = get_value(values)
+            if field_value is None:
+                return False
+            try:
+                return function(field_value, value)
+            except TypeError:
+                return False
+
+        return predicate, cost
+
+    def get_rule_names(self):
+        return list(self._rule_names)
+
+    def match(self, values):
+        """
+        :param values: the map to evaluate
+        :return: list with the names of the rules that hold, in declaration order
+        """
+        results = [None] * len(self._conditions)
+        return [rule_name for rule_name, rule in zip(self._rule_names, self._rules)
+                if self._evaluate_rule(rule, values, results)]
+
+    def first_match(self, values):
+        """
+        :param values: the map to evaluate
+        :return: the name of the first declared rule that holds, or None
+        """
+        results = [None] * len(self._conditions)
+        for rule_name, rule in zip(self._rule_names, self._rules):
+            if self._evaluate_rule(rule, values, results):
+                return rule_name
+        return None
+
+    def _evaluate_rule(self, rule, values, results):
+        for index in rule:
+            result = results[index]
+            if result is None:
+                result = results[index] = self._conditions[index][0](values)
+            if not result:
+                return False
+        return True
@@ -0,0 +1,35 @@
+import multiprocessing
+import time
+
+
+class SharedRateLimiter:
+    """
+    Token bucket shared by processes, the state lives in shared memory so every worker process created with it draws
+    from the same tokens. It has the acquire interface of the TokenBucket and blocks until a token is available.
+    """
+
+    def __init__(self, rate, capacity=None, context=None):
+        """
+        :param rate: tokens added per second
+        :param capacity: maximum burst, by default one second worth of tokens
+        :param context: the multiprocessing context of the worker processes, the default one by default
+        """
+        context = context or multiprocessing.get_context()
+        self._rate = rate
+        self._capacity = capacity if capacity else max(1, rate)
+        # Available tokens and the monotonic time of the last update, the monotonic clock is shared by the processes
+        self._state = context.Array('d', [self._capacity, time.monotonic()], lock=False)
+        self._lock = context.Lock()
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                available = min(self._capacity, self._state[0] + (now - self._state[1]) * self._rate)
+                self._state[1] = now
+                if available >= tokens:
+                    self._state[0] = available - tokens
+                    return
+                self._state[0] = available
+                wait_seconds = (tokens - available) / self._rate
+            time.sleep(wait_seconds)
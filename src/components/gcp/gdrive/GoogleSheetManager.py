@@ -1,16 +1,35 @@
+import json
 import os.path
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
+import random
+import re
+import time
+from src.commons.FileUtils import FileUtils
+from src.commons.Listing import Listing
 
 
 class GoogleSheetManager:
+    """
+    Reads and writes the tables of a spreadsheet. The Google client libraries are imported when they are first used,
+    they are slow to import and the short lived processes, e.g. the Lambda handler, pay it on every cold start.
+    """
 
     _token_file = 'token.json'
     _credentials_file = 'credentials.json'
     _scopes = ['https://www.googleapis.com/auth/spreadsheets']
     _sheet_id = None
+    _read_chunk_size = 5000
+    _write_chunk_cells = 20000
+    _max_retries = 5
+    _backoff_seconds = 1
+    _retry_status_codes = (429, 500, 502, 503, 504)
+    # The appends are not idempotent, a server error may come after the rows were written. Only the rejected requests
+    # are sent again.
+    _append_retry_status_codes = (429,)
+    _discovery_cache_file = None
+    _service_account_file = None
+    _interactive_auth = True
+    _table_cache = None
+    _rate_limiter = None
 
     _configuration = None
     _credentials = None
@@ -30,13 +49,50 @@ class GoogleSheetManager:
             self._scopes = configuration['scopes']
         if 'sheet_id' in configuration:
             self._sheet_id = configuration['sheet_id']
+        if 'read_chunk_size' in configuration:
+            self._read_chunk_size = configuration['read_chunk_size']
+        if 'write_chunk_cells' in configuration:
+            self._write_chunk_cells = configuration['write_chunk_cells']
+        if 'max_retries' in configuration:
+            self._max_retries = configuration['max_retries']
+        if 'backoff_seconds' in configuration:
+            self._backoff_seconds = configuration['backoff_seconds']
+        if 'discovery_cache_file' in configuration:
+            self._discovery_cache_file = configuration['discovery_cache_file']
+        if 'service_account_file' in configuration:
+            self._service_account_file = configuration['service_account_file']
+        if 'interactive_auth' in configuration:
+            self._interactive_auth = configuration['interactive_auth']
+        self._table_cache = {}
         self._authenticate()
         self._get_service()
 
+    def set_rate_limiter(self, rate_limiter):
+        """
+        :param rate_limiter: object with an acquire method called before every request, e.g. a TokenBucket
+        """
+        self._rate_limiter = rate_limiter
+
     def set_spreadsheet(self, sheet_id):
         self._sheet_id = sheet_id
+        self.clear_table_cache()
+
+    def clear_table_cache(self):
+        """
+        Forgets the header and the end of the tables learned by the appends, they are read again on the next append
+        """
+        self._table_cache = {}
 
     def _authenticate(self):
+        if self._service_account_file:
+            # Service accounts need neither a browser nor a stored token
+            from google.oauth2 import service_account
+            self._credentials = service_account.Credentials.from_service_account_file(
+                self._service_account_file, scopes=self._scopes
+            )
+            return
+
+        from google.oauth2.credentials import Credentials
         creds = None
         if os.path.exists(self._token_file):
             creds = Credentials.from_authorized_user_file(self._token_file, self._scopes)
@@ -46,64 +102,319 @@ class GoogleSheetManager:
             return
 
         if creds and creds.expired and creds.refresh_token:
+            from google.auth.transport.requests import Request
             creds.refresh(Request())
+        elif not self._interactive_auth:
+            raise RuntimeError(f'No valid token in {self._token_file} and the interactive authentication is disabled')
         else:
+            from google_auth_oauthlib.flow import InstalledAppFlow
             flow = InstalledAppFlow.from_client_secrets_file(self._credentials_file, self._scopes)
             creds = flow.run_local_server(port=0)
 
-        with open(self._token_file, 'w') as token:
-            token.write(creds.to_json())
+        try:
+            FileUtils.write_file_atomically(self._token_file, creds.to_json())
+        except OSError as error:
+            # e.g. a read only file system, the refreshed token is kept in memory while the process lives
+            print(f'WARNING:: The token could not be stored: {error}')
 
         self._credentials = creds
 
     def _get_service(self):
+        from googleapiclient.discovery import build, build_from_document
+        if self._discovery_cache_file and os.path.exists(self._discovery_cache_file):
+            try:
+                with open(self._discovery_cache_file) as discovery_file:
+                    self._service = build_from_document(discovery_file.read(), credentials=self._credentials)
+                return
+            except (OSError, ValueError) as error:
+                # A damaged cache is replaced by a freshly fetched document
+                print(f'WARNING:: The cached discovery document could not be used: {error}')
+
         self._service = build('sheets', 'v4', credentials=self._credentials)
+        if self._discovery_cache_file:
+            # Cache the discovery document so the next cold start does not need to fetch it
+            try:
+                FileUtils.write_file_atomically(self._discovery_cache_file, json.dumps(self._service._rootDesc))
+            except OSError as error:
+                print(f'WARNING:: The discovery document could not be cached: {error}')
 
     def get_table_data_as_map_array(self, sheet_range):
         sheet = self._service.spreadsheets()
-        result = sheet.values().get(spreadsheetId=self._sheet_id, range=sheet_range).execute()
+        result = self._execute_with_retry(sheet.values().get(spreadsheetId=self._sheet_id, range=sheet_range))
         values = result.get('values', [])
 
         if not values:
             print('ERROR:: No data found.')
+            return []
 
         # Get the columns to describe the rows, assume it will be in the header
         header = values[0]
         header_size = len(header)
         sheet_rows = []
         for row_number in range(1, len(values),1):
-            element_as_map = {}
-            for column_number in range(header_size):
-                element_as_map[header[column_number]] = values[row_number][column_number]
-            sheet_rows.append(element_as_map)
+            # The API trims the trailing empty cells of every row
+            row = values[row_number] + [''] * (header_size - len(values[row_number]))
+            sheet_rows.append(dict(zip(header, row)))
 
         # print(json.dumps(sheet_rows, indent=3))
         return sheet_rows
 
+    def get_table_header(self, sheet_range):
+        sheet_name, start_column, start_row, end_column = self._parse_range(sheet_range)
+        header_range = f'{sheet_name}!{start_column}{start_row}:{end_column}{start_row}'
+        result = self._execute_with_retry(
+            self._service.spreadsheets().values().get(spreadsheetId=self._sheet_id, range=header_range)
+        )
+        values = result.get('values', [])
+        return values[0] if values else []
+
+    def iterate_table_columns(self, sheet_range, columns=None, chunk_size=None, include_row_number=False):
+        """
+        Reads only the given columns of the table in chunks of rows and yields every row as a map. The columns are
+        resolved by name with the header, which is assumed to be the first row of the range.
+
+        :param sheet_range: the table range in A1 notation, e.g. Listado!B2:S
+        :param columns: the header names to fetch, all the header columns by default
+        :param chunk_size: number of rows fetched per request
+        :param include_row_number: adds the sheet row number of every row with the row_number key
+        :return: generator of maps with the requested columns
+        """
+        chunk_size = chunk_size or self._read_chunk_size
+        sheet_name, start_column, start_row, end_column = self._parse_range(sheet_range)
+        header = self.get_table_header(sheet_range)
+        if not header:
+            print('ERROR:: No data found.')
+            return
+        columns = columns or header
+        first_column_index = self._column_to_index(start_column)
+        column_letters = [self._index_to_column(first_column_index + header.index(column)) for column in columns]
+
+        chunk_start = start_row + 1
+        while True:
+            chunk_end = chunk_start + chunk_size - 1
+            ranges = [f'{sheet_name}!{letter}{chunk_start}:{letter}{chunk_end}' for letter in column_letters]
+            result = self._execute_with_retry(self._service.spreadsheets().values().batchGet(
+                spreadsheetId=self._sheet_id, ranges=ranges, majorDimension='COLUMNS'
+            ))
+            column_values = [value_range.get('values', [[]])[0] for value_range in result.get('valueRanges', [])]
+            row_count = max((len(values) for values in column_values), default=0)
+            for row_number in range(row_count):
+                row = [values[row_number] if row_number < len(values) else '' for values in column_values]
+                if any(row):
+                    row_map = dict(zip(columns, row))
+                    if include_row_number:
+                        row_map['row_number'] = chunk_start + row_number
+                    yield row_map
+            # The trailing empty cells are trimmed from every column, so a short chunk can still be followed by rows
+            # and only an empty chunk marks the end of the table
+            if row_count == 0:
+                return
+            chunk_start = chunk_end + 1
+
+    @staticmethod
+    def _parse_range(sheet_range):
+        match = re.fullmatch(r"(?:(.+)!)?([A-Z]+)(\d+)?(?::([A-Z]+)\d*)?", sheet_range)
+        if not match:
+            raise ValueError(f'The range {sheet_range} is not supported')
+        sheet_name, start_column, start_row, end_column = match.groups()
+        sheet_name = sheet_name if sheet_name else 'Sheet1'
+        return sheet_name, start_column, int(start_row) if start_row else 1, end_column or start_column
+
+    @staticmethod
+    def _column_to_index(column):
+        index = 0
+        for letter in column:
+            index = index * 26 + (ord(letter) - ord('A') + 1)
+        return index
+
+    @staticmethod
+    def _index_to_column(index):
+        column = ''
+        while index > 0:
+            index, remainder = divmod(index - 1, 26)
+            column = chr(ord('A') + remainder) + column
+        return column
+
     def set_table_data_from_map_array(self, sheet_range, data):
+        """
+        Writes the header and the given rows at the beginning of the range
+
+        :param sheet_range: the table range in A1 notation
+        :param data: list of maps, the keys of the first one are used as header
+        :return: the row number where the first data row was written
+        """
         if len(data) == 0:
             print('WARNING:: No data to process')
-            return
+            return None
 
-        values = [list(data[0].keys())]
-        for row in data:
-            values.append(list(row.values()))
-        body = {
-            'values': values
-        }
-        result = self._service.spreadsheets().values().update(
-            spreadsheetId=self._sheet_id, valueInputOption='RAW', range=sheet_range, body=body
-        ).execute()
-        print('{0} cells updated.'.format(result.get('updatedCells')))
+        sheet_name, start_column, start_row, end_column = self._parse_range(sheet_range)
+        header = list(data[0].keys())
+        values = [header] + self._map_rows_to_header(header, data)
+        self._batch_update_rows(sheet_name, start_column, start_row, values)
+        self._table_cache[sheet_range] = {'header': header, 'next_row': start_row + len(values)}
+        return start_row + 1
 
     def append_table_data_from_map_array(self, sheet_range, data_as_map):
-        values = []
-        for row in data_as_map:
-            values.append(list(row.values()))
-        body = {
-            'values': values
-        }
-        result = self._service.spreadsheets().values().append(
-            spreadsheetId=self._sheet_id, valueInputOption='RAW', range=sheet_range, body=body
-        ).execute()
-        print('{0} cells updated.'.format(result.get('updatedCells')))
\ No newline at end of file
+        """
+        Writes the given rows after the last row of the table following its header
+
+        :param sheet_range: the table range in A1 notation
+        :param data_as_map: list of maps to write
+        :return: the row number where the first row was written
+        """
+        if len(data_as_map) == 0:
+            print('WARNING:: No data to process')
+            return None
+
+        sheet_name, start_column, start_row, end_column = self._parse_range(sheet_range)
+        # Consecutive appends, e.g. while streaming, reuse the header and the end of the table
+        table = self._table_cache.get(sheet_range)
+        if table is None:
+            header = self.get_table_header(sheet_range)
+            if not header:
+                print('WARNING:: The sheet has no header, the whole table will be written')
+                return self.set_table_data_from_map_array(sheet_range, data_as_map)
+            table = {'header': header, 'next_row': None}
+            self._table_cache[sheet_range] = table
+
+        values = self._map_rows_to_header(table['header'], data_as_map)
+        if table['next_row'] is None:
+            # The end of the table is unknown, the first chunk is appended by the API and its response tells where
+            # it was written, so the table does not have to be read
+            rows_per_chunk = max(1, self._write_chunk_cells // max(len(row) for row in values))
+            first_row = self._append_rows(sheet_name, start_column, start_row, values[:rows_per_chunk])
+            if len(values) > rows_per_chunk:
+                self._batch_update_rows(sheet_name, start_column, first_row + rows_per_chunk, values[rows_per_chunk:])
+        else:
+            first_row = table['next_row']
+            self._batch_update_rows(sheet_name, start_column, first_row, values)
+        table['next_row'] = first_row + len(values)
+        return first_row
+
+    def get_column_cells(self, sheet_range, column_name, row_numbers):
+        """
+        Reads single cells of a column of the table, e.g. to check which listing a row holds before updating it
+
+        :param sheet_range: the table range in A1 notation
+        :param column_name: the header name of the column
+        :param row_numbers: iterable of sheet row numbers
+        :return: map of row numbers to the cell values, '' for the empty cells
+        """
+        row_numbers = sorted(set(row_numbers))
+        if not row_numbers:
+            return {}
+        sheet_name, start_column, start_row, end_column = self._parse_range(sheet_range)
+        table = self._table_cache.get(sheet_range)
+        header = table['header'] if table is not None else self.get_table_header(sheet_range)
+        if column_name not in header:
+            raise ValueError(f'The column {column_name} is not in the sheet header')
+        letter = self._index_to_column(self._column_to_index(start_column) + header.index(column_name))
+        cells = {}
+        # The ranges go in the query string of the request, so only a few hundred of them fit in one
+        for chunk_start in range(0, len(row_numbers), 200):
+            chunk = row_numbers[chunk_start:chunk_start + 200]
+            result = self._execute_with_retry(self._service.spreadsheets().values().batchGet(
+                spreadsheetId=self._sheet_id, ranges=[f'{sheet_name}!{letter}{row}:{letter}{row}' for row in chunk]
+            ))
+            for row, value_range in zip(chunk, result.get('valueRanges', [])):
+                values = value_range.get('values', [])
+                cells[row] = values[0][0] if values and values[0] else ''
+        return cells
+
+    def update_table_cells(self, sheet_range, updates):
+        """
+        Updates single cells of the table, the columns are resolved by name with the header. Only the given cells are
+        sent, in values.batchUpdate requests bounded by the configured number of cells.
+
+        :param sheet_range: the table range in A1 notation
+        :param updates: list of (row_number, column_name, value) tuples
+        :return: the number of cells updated
+        """
+        if len(updates) == 0:
+            return 0
+        sheet_name, start_column, start_row, end_column = self._parse_range(sheet_range)
+        table = self._table_cache.get(sheet_range)
+        header = table['header'] if table is not None else self.get_table_header(sheet_range)
+        first_column_index = self._column_to_index(start_column)
+        data = []
+        for row_number, column_name, value in updates:
+            if column_name not in header:
+                print(f'WARNING:: The column {column_name} is not in the sheet header, the update is skipped')
+                continue
+            cell = f'{self._index_to_column(first_column_index + header.index(column_name))}{row_number}'
+            data.append({'range': f'{sheet_name}!{cell}', 'values': [[value]]})
+
+        updated_cells = 0
+        for chunk_start in range(0, len(data), self._write_chunk_cells):
+            body = {'valueInputOption': 'RAW', 'data': data[chunk_start:chunk_start + self._write_chunk_cells]}
+            result = self._execute_with_retry(
+                self._service.spreadsheets().values().batchUpdate(spreadsheetId=self._sheet_id, body=body)
+            )
+            updated_cells += result.get('totalUpdatedCells', 0)
+        print(f'INFO:: {updated_cells} changed cells updated')
+        return updated_cells
+
+    def _append_rows(self, sheet_name, start_column, start_row, values):
+        """
+        Appends the rows after the last row of the table with values.append
+
+        :return: the row number where the first row was written
+        """
+        result = self._execute_with_retry(self._service.spreadsheets().values().append(
+            spreadsheetId=self._sheet_id, range=f'{sheet_name}!{start_column}{start_row}', valueInputOption='RAW',
+            insertDataOption='OVERWRITE', body={'values': values}
+        ), retry_status_codes=self._append_retry_status_codes)
+        updates = result.get('updates', {})
+        print(f'INFO:: {updates.get("updatedCells")} cells appended')
+        return self._parse_range(updates['updatedRange'])[2]
+
+    @staticmethod
+    def _map_rows_to_header(header, data):
+        # The rows are written following the sheet header and not the order of the map keys, the listings build
+        # their rows straight from their fields
+        return [row.to_row(header) if isinstance(row, Listing) else [row.get(column, '') for column in header]
+                for row in data]
+
+    def _batch_update_rows(self, sheet_name, start_column, first_row, values):
+        """
+        Writes the rows starting at the given row with one values.batchUpdate per chunk, the chunks are bounded by
+        the configured number of cells to keep the payloads below the API limits.
+
+        :param sheet_name: the name of the sheet to write to
+        :param start_column: the column letter where the rows start
+        :param first_row: the row number of the first row to write
+        :param values: list of rows, every row is a list of cell values
+        """
+        width = max(len(row) for row in values)
+        rows_per_chunk = max(1, self._write_chunk_cells // width)
+        end_column = self._index_to_column(self._column_to_index(start_column) + width - 1)
+        number_of_chunks = (len(values) + rows_per_chunk - 1) // rows_per_chunk
+        for chunk_number, chunk_start in enumerate(range(0, len(values), rows_per_chunk), 1):
+            chunk = values[chunk_start:chunk_start + rows_per_chunk]
+            row = first_row + chunk_start
+            body = {
+                'valueInputOption': 'RAW',
+                'data': [{
+                    'range': f'{sheet_name}!{start_column}{row}:{end_column}{row + len(chunk) - 1}',
+                    'values': chunk
+                }]
+            }
+            result = self._execute_with_retry(
+                self._service.spreadsheets().values().batchUpdate(spreadsheetId=self._sheet_id, body=body)
+            )
+            print(f'INFO:: {result.get("totalUpdatedCells")} cells updated in chunk {chunk_number} of {number_of_chunks}')
+
+    def _execute_with_retry(self, request, retry_status_codes=None):
+        from googleapiclient.errors import HttpError
+        retry_status_codes = retry_status_codes or self._retry_status_codes
+        for attempt in range(self._max_retries + 1):
+            if self._rate_limiter is not None:
+                self._rate_limiter.acquire()
+            try:
+                return request.execute()
+            except HttpError as error:
+                if error.resp.status not in retry_status_codes or attempt == self._max_retries:
+                    raise
+                wait_seconds = self._backoff_seconds * (2 ** attempt) + random.uniform(0, self._backoff_seconds)
+                print(f'WARNING:: The sheets request failed with code {error.resp.status}, retrying in {wait_seconds:.1f} seconds')
+                time.sleep(wait_seconds)
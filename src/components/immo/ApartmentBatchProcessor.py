@@ -0,0 +1,123 @@
+import numpy as np
+from src.commons.DataManipulationUtils import DataManipulationUtils
+from src.components.immo.ListingFilter import ListingFilter
+
+
+class ApartmentBatchProcessor:
+    """
+    Columnar version of the apartment filters and score. A whole list of result entries is turned into NumPy arrays
+    and the reject masks, distances and scores are calculated in a single vectorized pass. It is used per page by the
+    ImmoManager and can score large historical dumps offline.
+    """
+
+    _center_coordinates = (52.519606771749594, 13.407080083827983)
+    # Same mean earth radius used by haversine
+    _earth_radius = 6371.0088
+
+    _configuration = None
+    _location_scorer = None
+    _listing_filter = None
+
+    def __init__(self, configuration):
+        """
+        Constructor using standard a configuation map
+
+        :param configuration:
+        """
+        self._configuration = configuration
+        if 'center_coordinates' in configuration:
+            self._center_coordinates = tuple(configuration['center_coordinates'])
+        self._listing_filter = ListingFilter(configuration.get('filters', {}))
+
+    def set_location_scorer(self, location_scorer):
+        self._location_scorer = location_scorer
+
+    def score_entries(self, entry_list):
+        """
+        Calculates the filters and scores of the given result entries
+
+        :param entry_list: list of resultlistEntry elements as returned by the search
+        :return: map of arrays aligned with the entries: reject_code ('' when valid, otherwise the filter code),
+                 picture_number, latitude, longitude, distance_center and score (NaN for rejected entries), and the
+                 lists of coordinates, with the values as they were resolved, and location_features (None for
+                 rejected entries or without a location scorer)
+        """
+        number_of_entries = len(entry_list)
+        real_estates = [entry['resultlist.realEstate'] for entry in entry_list]
+
+        picture_number = np.fromiter(
+            (len(real_estate['galleryAttachments']['attachment']) if 'galleryAttachments' in real_estate else 0
+             for real_estate in real_estates), dtype=np.int64, count=number_of_entries
+        )
+        reject_code = self._listing_filter.get_rejection_codes(real_estates, picture_number)
+        is_valid = reject_code == ''
+
+        # The numeric columns are only extracted for the valid entries, the rejected ones may not have them
+        valid_indexes = np.flatnonzero(is_valid)
+        valid_estates = [real_estates[index] for index in valid_indexes]
+        latitude = np.zeros(number_of_entries)
+        longitude = np.zeros(number_of_entries)
+        size = np.full(number_of_entries, np.nan)
+        hot_rent = np.full(number_of_entries, np.nan)
+        room_number = np.full(number_of_entries, np.nan)
+        built_in_kitchen = np.zeros(number_of_entries)
+        have_balcony = np.zeros(number_of_entries)
+        if self._location_scorer is not None:
+            coordinates = [self._location_scorer.resolve_coordinates(entry_list[index]['resultlist.realEstate']['address'],
+                                                                     entry_list[index]['@id'])
+                           for index in valid_indexes]
+        else:
+            coordinates = [self._get_coordinates(real_estate['address']) for real_estate in valid_estates]
+        latitude[valid_indexes] = [coordinate[0] for coordinate in coordinates]
+        longitude[valid_indexes] = [coordinate[1] for coordinate in coordinates]
+        size[valid_indexes] = [real_estate['livingSpace'] for real_estate in valid_estates]
+        hot_rent[valid_indexes] = [real_estate['calculatedTotalRent']['totalRent']['value'] for real_estate in valid_estates]
+        room_number[valid_indexes] = [real_estate['numberOfRooms'] for real_estate in valid_estates]
+        built_in_kitchen[valid_indexes] = [bool(real_estate['builtInKitchen']) for real_estate in valid_estates]
+        have_balcony[valid_indexes] = [bool(real_estate['balcony']) for real_estate in valid_estates]
+
+        has_coordinates = (latitude > 0) & (longitude > 0)
+        # Rounded like DataManipulationUtils.round_distance, the NumPy trigonometry can differ in the last bit from the
+        # haversine package and the distance is part of the tracked content of the listings
+        scale = DataManipulationUtils.DISTANCE_SCALE
+        distance_center = np.where(has_coordinates, np.rint(self._haversine(latitude, longitude) * scale) / scale, 9999)
+        # The resolved values are kept so the output is the same as the one of the scalar path, e.g. 0 and not 0.0
+        entry_coordinates = [None] * number_of_entries
+        for index, coordinate in zip(valid_indexes, coordinates):
+            entry_coordinates[index] = coordinate
+        # The points of interest are looked up in the grid index once per position, the score term is added at once
+        location_features = [None] * number_of_entries
+        location_score = np.zeros(number_of_entries)
+        if self._location_scorer is not None and len(valid_indexes):
+            features, location_score[valid_indexes] = self._location_scorer.get_features_and_scores(
+                latitude[valid_indexes], longitude[valid_indexes])
+            for index, entry_features in zip(valid_indexes, features):
+                location_features[index] = entry_features
+        with np.errstate(divide='ignore', invalid='ignore'):
+            raw_score = (20 * (size / hot_rent)) + (0.5 * built_in_kitchen) + (0.5 * have_balcony) \
+                        + (4 * (1 / distance_center)) + (room_number / 8) + location_score
+        score = np.where(is_valid, raw_score * 100 + picture_number, np.nan)
+
+        return {
+            'reject_code': reject_code,
+            'picture_number': picture_number,
+            'latitude': latitude,
+            'longitude': longitude,
+            'distance_center': distance_center,
+            'score': score,
+            'has_coordinates': has_coordinates,
+            'coordinates': entry_coordinates,
+            'location_features': location_features
+        }
+
+    @staticmethod
+    def _get_coordinates(address):
+        coordinate = address.get('wgs84Coordinate', {})
+        return coordinate.get('latitude', 0), coordinate.get('longitude', 0)
+
+    def _haversine(self, latitude, longitude):
+        center_latitude, center_longitude = np.radians(self._center_coordinates[0]), np.radians(self._center_coordinates[1])
+        latitude, longitude = np.radians(latitude), np.radians(longitude)
+        d = np.sin((latitude - center_latitude) * 0.5) ** 2 \
+            + np.cos(center_latitude) * np.cos(latitude) * np.sin((longitude - center_longitude) * 0.5) ** 2
+        return 2 * self._earth_radius * np.arcsin(np.sqrt(d))
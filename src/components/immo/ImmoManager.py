@@ -1,20 +1,52 @@
 import requests
 import datetime
+import hashlib
 import json
-from haversine import haversine
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+from requests.adapters import HTTPAdapter
+from src.commons.DataManipulationUtils import DataManipulationUtils
+from src.commons.Listing import Listing
+from src.commons.MetricsCollector import MetricsCollector
+from src.components.immo.ListingFilter import ListingFilter
+from src.components.immo.SearchResponseCache import SearchResponseCache
 
 
 class ImmoManager:
 
-    # TODO: Pythonic setter and getter missing
+    # The counters are reset per instance and run, see reset_counters
     total_success = 0
     total_exchange = 0
     total_wbs = 0
     total_rejected = 0
     total_entries = 0
 
+    _base_url = 'https://www.immobilienscout24.de'
     _configuration = None
     _first_url = None
+    _search_urls = None
+    _max_workers = 1
+    _max_parallel_searches = 4
+    _session = None
+    _batch_processor = None
+    _seen_ids = None
+    _processing_lock = None
+    _metrics = None
+    _response_cache = None
+    _skip_unchanged_pages = False
+    _pending_fingerprints = None
+    _pending_publish_dates = None
+    _location_scorer = None
+    _listing_filter = None
+    _rate_limiter = None
+    _shared_responses = None
+    _keep_rejected = False
+    _rejected_entries = None
 
     def __init__(self, configuration):
         """
@@ -25,21 +57,226 @@ class ImmoManager:
         self._configuration = configuration
         if 'first_url' in configuration:
             self._first_url = configuration['first_url']
+        if 'search_urls' in configuration:
+            self._search_urls = list(configuration['search_urls'])
+        if 'max_parallel_searches' in configuration:
+            self._max_parallel_searches = max(1, int(configuration['max_parallel_searches']))
+        if 'base_url' in configuration:
+            self._base_url = configuration['base_url']
+        if 'max_workers' in configuration:
+            self._max_workers = max(1, int(configuration['max_workers']))
+        self._listing_filter = ListingFilter(configuration.get('filters', {}))
+        if 'location' in configuration:
+            # The optional components are imported on demand, NumPy alone is slow to import on a cold start
+            from src.components.location.LocationScorer import LocationScorer
+            self._location_scorer = LocationScorer(configuration['location'])
+        if configuration.get('vectorized', False):
+            from src.components.immo.ApartmentBatchProcessor import ApartmentBatchProcessor
+            self._batch_processor = ApartmentBatchProcessor(configuration)
+            self._batch_processor.set_location_scorer(self._location_scorer)
+        if 'response_cache' in configuration:
+            self._response_cache = SearchResponseCache(configuration['response_cache'])
+            self._skip_unchanged_pages = configuration.get('skip_unchanged_pages', False)
+        self._keep_rejected = configuration.get('keep_rejected', False)
+        self._pending_fingerprints = {}
+        self._rejected_entries = []
+        self._processing_lock = threading.Lock()
+        self._metrics = MetricsCollector({})
+        self.reset_counters()
+        self._session = self._create_session()
+
+    def _create_session(self):
+        # One keep-alive pool shared by every page request, sized for the concurrent fetch of every search
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._max_workers * self._max_parallel_searches)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def reset_counters(self):
+        self.total_success = 0
+        self.total_exchange = 0
+        self.total_wbs = 0
+        self.total_rejected = 0
+        self.total_entries = 0
+
+    def set_metrics(self, metrics):
+        self._metrics = metrics
+
+    def set_rate_limiter(self, rate_limiter):
+        """
+        :param rate_limiter: object with an acquire method called before every search request, e.g. a TokenBucket
+        """
+        self._rate_limiter = rate_limiter
+
+    def set_shared_responses(self, shared_responses):
+        """
+        :param shared_responses: map of url to search results shared with other managers, the urls found in it are
+                                 not requested again and the downloaded ones are added to it. None disables it.
+        """
+        self._shared_responses = shared_responses
 
     def set_first_url(self,url):
         self._first_url = url
 
-    def get_processed_search_results(self):
-        search_results = self._get_search_results(self._first_url)
-        processed_entries = self._process_search_results(search_results)
+    def set_search_urls(self, urls):
+        self._search_urls = list(urls)
+
+    def get_processed_search_results(self, known_ids=None, high_water_date=None):
+        """
+        Fetches and processes the searches, see iterate_processed_pages
+
+        :param known_ids: set of listing ids already processed in previous runs
+        :param high_water_date: newest @publishDate already processed, ISO string or datetime, or map of search urls to
+                                it, listings published at or before it are known
+        :return: the processed entries indexed by id
+        """
+        processed_entries = {}
+        for page_entries in self.iterate_processed_pages(known_ids, high_water_date):
+            processed_entries.update(page_entries)
+        if self._search_urls and len(self._search_urls) > 1:
+            print(f'INFO:: Found {len(processed_entries)} unique entries in {len(self._search_urls)} searches')
         print(f'INFO:: There were {self.total_success} success, {self.total_exchange} exchange offers and {self.total_wbs} WBS from a total of {self.total_entries} entries')
         return processed_entries
 
-    @staticmethod
-    def _get_search_results(url):
-        response = requests.post(url)
+    def iterate_processed_pages(self, known_ids=None, high_water_date=None):
+        """
+        Fetches and processes the searches yielding the new processed entries of every page as soon as it is
+        available. When many search urls are configured they are crawled in parallel and every listing is processed
+        and yielded only once even if it shows up in many searches. When known ids or a high-water publish date are
+        given the crawl is incremental and stops once a page only contains known listings, this requires the searches
+        to be sorted by newest first. The newest publish date seen by every search is kept, see
+        pop_newest_publish_dates.
+
+        :param known_ids: set of listing ids already processed in previous runs
+        :param high_water_date: newest @publishDate already processed, ISO string or datetime, or map of search urls to
+                                it, listings published at or before it are known. A listing older than the newest one
+                                of a search can still be new in another search, so every search should use its own.
+        :return: generator of maps with the processed entries of a page indexed by id
+        """
+        search_urls = self._search_urls if self._search_urls else [self._first_url]
+        if not isinstance(high_water_date, dict):
+            high_water_date = {url: high_water_date for url in search_urls}
+        high_water_dates = {url: DataManipulationUtils.parse_publish_date(date) if date is not None else None
+                            for url, date in high_water_date.items()}
+        self._seen_ids = {}
+        self._pending_fingerprints = {}
+        self._pending_publish_dates = {}
+        self._rejected_entries = []
+        self.total_entries = 0
+        if len(search_urls) == 1:
+            yield from self._iterate_search(search_urls[0], known_ids, high_water_dates.get(search_urls[0]))
+            return
+
+        # The searches are crawled by worker threads, the bounded queue stops them when the consumer is behind
+        page_queue = queue.Queue(maxsize=self._max_parallel_searches * 2)
+        stop_event = threading.Event()
+
+        def crawl(url):
+            for page_entries in self._iterate_search(url, known_ids, high_water_dates.get(url)):
+                while not stop_event.is_set():
+                    try:
+                        page_queue.put(page_entries, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop_event.is_set():
+                    return
+
+        with ThreadPoolExecutor(max_workers=min(len(search_urls), self._max_parallel_searches)) as executor:
+            futures = [executor.submit(crawl, url) for url in search_urls]
+            try:
+                while True:
+                    try:
+                        yield page_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        if all(future.done() for future in futures) and page_queue.empty():
+                            break
+                for future in futures:
+                    future.result()
+            finally:
+                stop_event.set()
+
+    def commit_page_fingerprints(self):
+        """
+        Stores the fingerprints of the pages processed in the last crawl, it has to be called once their entries are
+        safely stored so the next runs can skip the pages that did not change
+        """
+        if self._response_cache is None:
+            return
+        for url, fingerprint in self._pending_fingerprints.items():
+            self._response_cache.set_fingerprint(url, fingerprint)
+        self._pending_fingerprints = {}
+
+    def pop_newest_publish_dates(self):
+        """
+        Hands over the newest publish date of the listings processed by every search in the last crawl, they can be
+        used as the high-water dates of the next crawl once the listings are safely stored
+
+        :return: map of search urls to ISO dates
+        """
+        with self._processing_lock:
+            publish_dates = {url: date.isoformat() for url, date in (self._pending_publish_dates or {}).items()}
+            self._pending_publish_dates = {}
+        return publish_dates
+
+    def _iterate_search(self, url, known_ids, high_water_date):
+        search_results = self._get_search_results(url)
+        with self._processing_lock:
+            self.total_entries += search_results['searchResponseModel']['resultlist.resultlist']['paging']['numberOfListings']
+        if known_ids is not None or high_water_date is not None:
+            pages = self._iterate_search_pages_incrementally(url, search_results, known_ids or set(), high_water_date)
+        else:
+            pages = self._iterate_search_pages(url, search_results)
+        for page_entries in pages:
+            self._track_newest_publish_date(url, page_entries)
+            yield page_entries
+
+    def _track_newest_publish_date(self, url, page_entries):
+        # The listings shared with another search may be processed by that one, its mark is then only lower
+        publish_dates = (DataManipulationUtils.parse_publish_date(entry.publish_date) for entry in page_entries.values())
+        newest_date = max((date for date in publish_dates if date is not None), default=None)
+        if newest_date is None:
+            return
+        with self._processing_lock:
+            current_date = self._pending_publish_dates.get(url)
+            if current_date is None or newest_date > current_date:
+                self._pending_publish_dates[url] = newest_date
+
+    def _get_search_results(self, url):
+        if self._shared_responses is None:
+            return self._request_search_results(url)
+        search_results = self._shared_responses.get(url)
+        if search_results is not None:
+            self._metrics.increment('cached_pages', status='shared')
+            return search_results
+        search_results = self._request_search_results(url)
+        self._shared_responses[url] = search_results
+        return search_results
+
+    def _request_search_results(self, url):
+        cached_response = self._response_cache.get(url) if self._response_cache is not None else None
+        if cached_response is not None and self._response_cache.is_fresh(cached_response):
+            self._metrics.increment('cached_pages', status='fresh')
+            return json.loads(cached_response['body'])
+
+        headers = self._response_cache.get_validation_headers(cached_response) if cached_response else {}
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire()
+        start = time.perf_counter()
+        response = self._session.post(url, headers=headers)
+        self._metrics.observe('page_request_seconds', time.perf_counter() - start)
+        self._metrics.increment('downloaded_bytes', len(response.content))
+        self._metrics.increment('pages_downloaded')
         status_code = response.status_code
-        json_body = json.loads(response.content)
+        if status_code == 304 and cached_response is not None:
+            self._metrics.increment('cached_pages', status='not_modified')
+            self._response_cache.refresh(url)
+            return json.loads(cached_response['body'])
+
+        json_body = response.json()
+        if self._response_cache is not None and status_code == 200:
+            self._response_cache.store(url, response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'))
         if status_code >= 200:
             print(f'INFO:: The request was successfuly processed with code {status_code}')
         else:
@@ -47,18 +284,117 @@ class ImmoManager:
 
         return json_body
 
-    def _process_search_results(self, search_results):
+    def _iterate_search_pages(self, url, search_results):
+        """
+        Uses the first page to learn the number of pages and fetches the rest of them, in parallel when more than one
+        worker is configured. The pages are mapped and yielded in page order.
 
+        :param url: the url of the first page
+        :param search_results: the already fetched first page
+        :return: generator with the processed entries of every page
+        """
         next_page, number_of_pages, page_number, page_size = self._get_apartment_metadata(search_results)
-        processed_entries = {}
-        for iteration in range(number_of_pages - 1):
-            mapped_entries = self._get_mapped_apartment_data(search_results)
-            processed_entries = processed_entries | mapped_entries
-            search_results = self._get_search_results('https://www.immobilienscout24.de'+next_page)
-            next_page, number_of_pages, page_number, page_size = self._get_apartment_metadata(search_results)
+        yield self._map_page(url, search_results) or {}
+        if next_page is None:
+            return
 
-        # print(json.dumps(processed_entries, indent=3))
-        return processed_entries
+        page_urls = [self._build_page_url(next_page, page) for page in range(page_number + 1, number_of_pages + 1)]
+        print(f'INFO:: Fetching {len(page_urls)} pages with {self._max_workers} workers')
+        for page_url, page_results in zip(page_urls, self._fetch_pages_in_order(page_urls)):
+            self._get_apartment_metadata(page_results)
+            yield self._map_page(page_url, page_results) or {}
+
+    def _iterate_search_pages_incrementally(self, url, search_results, known_ids, high_water_date):
+        next_page, number_of_pages, page_number, page_size = self._get_apartment_metadata(search_results)
+        mapped_entries = self._map_page(url, search_results)
+        # An unchanged page was already processed in the last run, so it only has known listings. The page is checked
+        # before it is yielded, the consumer can store its new listings while the generator is paused
+        is_known_page = mapped_entries is None or self._is_known_page(search_results, known_ids, high_water_date)
+        yield mapped_entries or {}
+        if is_known_page:
+            print(f'INFO:: The page {page_number} only has known listings, stopping the crawl')
+            return
+
+        remaining_pages = iter(range(page_number + 1, number_of_pages + 1))
+        # Pages are fetched in windows of max_workers pages so the crawl can stop early
+        while True:
+            page_window = list(islice(remaining_pages, self._max_workers))
+            if not page_window:
+                return
+            page_urls = [self._build_page_url(next_page, page) for page in page_window]
+            for page, page_url, page_results in zip(page_window, page_urls, self._fetch_pages_in_order(page_urls)):
+                self._get_apartment_metadata(page_results)
+                mapped_entries = self._map_page(page_url, page_results)
+                is_known_page = mapped_entries is None or self._is_known_page(page_results, known_ids, high_water_date)
+                yield mapped_entries or {}
+                if is_known_page:
+                    print(f'INFO:: The page {page} only has known listings, stopping the crawl')
+                    return
+
+    def _fetch_pages_in_order(self, page_urls):
+        if self._max_workers == 1:
+            for page_url in page_urls:
+                yield self._get_search_results(page_url)
+            return
+
+        # Only a window of pages is requested ahead, so the downloaded pages do not pile up in memory
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            pending = deque()
+            page_urls = iter(page_urls)
+            for page_url in islice(page_urls, self._max_workers * 2):
+                pending.append(executor.submit(self._get_search_results, page_url))
+            while pending:
+                page_results = pending.popleft().result()
+                for page_url in islice(page_urls, 1):
+                    pending.append(executor.submit(self._get_search_results, page_url))
+                yield page_results
+
+    def _map_page(self, url, search_results):
+        """
+        Maps the entries of the page unless the page has the same listings as in the last run
+
+        :return: the new processed entries of the page, or None when the page did not change
+        """
+        if self._skip_unchanged_pages:
+            fingerprint = self._get_page_fingerprint(search_results)
+            if self._response_cache.get_fingerprint(url) == fingerprint:
+                print(f'DEBUG:: The page {url} did not change since the last run, skipping it')
+                self._metrics.increment('unchanged_pages')
+                return None
+            with self._processing_lock:
+                self._pending_fingerprints[url] = fingerprint
+        return self._get_mapped_apartment_data(search_results)
+
+    @staticmethod
+    def _get_page_fingerprint(search_results):
+        # The ids and modification dates of the listings, the rest of the page changes on every request
+        entry_list = search_results['searchResponseModel']['resultlist.resultlist']['resultlistEntries'][0]['resultlistEntry']
+        listing_keys = ','.join(f'{entry["@id"]}:{entry.get("@modification", "")}' for entry in entry_list)
+        return hashlib.sha1(listing_keys.encode()).hexdigest()
+
+    def _is_known_page(self, search_results, known_ids, high_water_date):
+        entry_list = search_results['searchResponseModel']['resultlist.resultlist']['resultlistEntries'][0]['resultlistEntry']
+        # Only the valid listings count, they are the ones that end up in the sheet
+        valid_entries = [entry for entry in entry_list if self._seen_ids.get(entry['@id'])]
+        # A page without valid entries says nothing about the listings behind it, so keep going
+        if not valid_entries:
+            return False
+        for entry in valid_entries:
+            if entry['@id'] in known_ids:
+                continue
+            if high_water_date is not None:
+                publish_date = DataManipulationUtils.parse_publish_date(entry.get('@publishDate'))
+                if publish_date is not None and publish_date <= high_water_date:
+                    continue
+            return False
+        return True
+
+    def _build_page_url(self, next_page, page_number):
+        # The next link of the first page is used as template as it carries the search parameters
+        url = urlparse(self._base_url + next_page)
+        query = [(key, value) for key, value in parse_qsl(url.query) if key != 'pagenumber']
+        query.append(('pagenumber', str(page_number)))
+        return urlunparse(url._replace(query=urlencode(query)))
 
     def _get_apartment_metadata(self, search_results):
         metadata = {
@@ -69,7 +405,6 @@ class ImmoManager:
         page_size = metadata['paging']['pageSize']
         number_of_pages = metadata['paging']['numberOfPages']
         number_of_listings = metadata['paging']['numberOfListings']
-        self.total_entries = number_of_listings
         if 'next' in metadata['paging']:
             next_page = metadata['paging']['next']['@xlink.href']
         else:
@@ -81,14 +416,28 @@ class ImmoManager:
         return next_page, number_of_pages, page_number, page_size
 
     def _get_mapped_apartment_data(self, search_results):
-        processed_entries = {}
         entry_list = search_results['searchResponseModel']['resultlist.resultlist']['resultlistEntries'][0]['resultlistEntry']
 
         print(f'DEBUG:: Processing {len(entry_list)} entries')
 
+        with self._processing_lock:
+            # Listings already seen in this run, by this or another search, are not processed again. Only whether
+            # they were valid is kept, the processed entries are handed over to the caller.
+            new_entries = [entry for entry in entry_list if entry['@id'] not in self._seen_ids]
+            mapped_entries = self._map_entries(new_entries)
+            for entry in new_entries:
+                self._seen_ids[entry['@id']] = entry['@id'] in mapped_entries
+            return mapped_entries
+
+    def _map_entries(self, entry_list):
+        processed_entries = {}
+        if self._batch_processor is not None:
+            return self._get_mapped_apartment_data_in_batch(entry_list)
+
         for entry in entry_list:
             entry_id, processed_entry, errors = self._process_single_apartment(entry)
             if entry_id is None or processed_entry is None:
+                self._count_rejection(entry, errors[0]['code'])
                 continue
             processed_entries[entry_id] = processed_entry
             self.total_success += 1
@@ -96,37 +445,124 @@ class ImmoManager:
 
         return processed_entries
 
-    def _process_single_apartment(self, entry):
+    def _get_mapped_apartment_data_in_batch(self, entry_list):
+        # Filters, distances and scores are calculated for the whole page at once, only the output is built one by one
+        processed_entries = {}
+        batch = self._batch_processor.score_entries(entry_list)
+        for index, entry in enumerate(entry_list):
+            reject_code = batch['reject_code'][index]
+            if reject_code:
+                self._count_rejection(entry, str(reject_code))
+                continue
+            # Same values as _process_single_apartment, the listings without coordinates are 9999 km away
+            distance_center = float(batch['distance_center'][index]) if batch['has_coordinates'][index] else 9999
+            processed_entry = self._build_processed_entry(
+                entry, int(batch['picture_number'][index]), distance_center, float(batch['score'][index]),
+                batch['coordinates'][index], batch['location_features'][index]
+            )
+            processed_entries[processed_entry.id] = processed_entry
+            self.total_success += 1
 
-        entry_id = entry['@id']
-        # Filter out
-        title = entry['resultlist.realEstate']['title']
-        if 'tauschwohnung' in title.lower():
-            # print(f'DEBUG:: The id {id} is an exchange apartment and will be rejected')
+        return processed_entries
+
+    def _count_rejection(self, entry, reject_code):
+        self.total_rejected += 1
+        if reject_code == 'E001':
             self.total_exchange += 1
-            return None, None, [{'code': 'E001', 'message': 'Exchange entries are not valid'}]
-        if 'wbs' in title.lower():
-            # print(f'DEBUG:: The id {id} requires wbs and will be rejected')
+        elif reject_code == 'E002':
             self.total_wbs += 1
-            return None, None, [{'code': 'E002', 'message': 'WBS entries are not valid'}]
+        self._metrics.increment('rejected_entries', reason=reject_code)
+        if self._keep_rejected:
+            self._rejected_entries.append(self._build_rejected_entry(entry, reject_code))
+
+    @staticmethod
+    def _build_rejected_entry(entry, reject_code):
+        # Only the values needed for the market history, the rejected listings can miss any of them
+        real_estate = entry['resultlist.realEstate']
+        return {
+            'id': entry['@id'],
+            'reject_code': reject_code,
+            'cold_rent': real_estate.get('price', {}).get('value'),
+            'hot_rent': real_estate.get('calculatedTotalRent', {}).get('totalRent', {}).get('value'),
+            'size': real_estate.get('livingSpace'),
+            'room_number': real_estate.get('numberOfRooms'),
+            'quarter': real_estate.get('address', {}).get('quarter'),
+            'title': real_estate.get('title'),
+            'publish_date': entry.get('@publishDate')
+        }
+
+    def pop_rejected_entries(self):
+        """
+        Hands over the listings rejected since the last call, so they are not kept for the whole run
+
+        :return: list with the rejected listings, only kept when keep_rejected is configured
+        """
+        with self._processing_lock:
+            rejected_entries = self._rejected_entries
+            self._rejected_entries = []
+        return rejected_entries
+
+    def _process_single_apartment(self, entry):
+
+        entry_id = entry['@id']
         # Process pictures
         picture_number = 0
         if 'galleryAttachments' in entry['resultlist.realEstate']:
             picture_number = len(entry['resultlist.realEstate']['galleryAttachments']['attachment'])
-        if picture_number < 5:
-            return None, None, [{'code': 'E003', 'message': 'Too low number of pictures'}]
+        # Filter out
+        rejection = self._listing_filter.get_rejection(entry['resultlist.realEstate'], picture_number)
+        if rejection is not None:
+            return None, None, [rejection]
         # Process address
-        address = entry['resultlist.realEstate']['address']
-        if 'wgs84Coordinate' in address:
-            latitude = address['wgs84Coordinate']['latitude']
-            longitude = address['wgs84Coordinate']['longitude']
-        else:
-            latitude = 0
-            longitude = 0
-        quarter = address['quarter']
+        from haversine import haversine
+        latitude, longitude = self._get_coordinates(entry['resultlist.realEstate']['address'], entry_id)
         center_coordinates = (52.519606771749594, 13.407080083827983)
         apartment_coordinates = (latitude, longitude)
-        distance_center = haversine(center_coordinates, apartment_coordinates) if latitude > 0 and longitude > 0 else 9999
+        distance_center = 9999
+        if latitude > 0 and longitude > 0:
+            distance_center = DataManipulationUtils.round_distance(haversine(center_coordinates, apartment_coordinates))
+        location_features = None
+        if self._location_scorer is not None:
+            location_features = self._location_scorer.get_features(latitude, longitude)
+        # Calculate total apartment score
+        real_estate = entry['resultlist.realEstate']
+        size = real_estate['livingSpace']
+        hot_rent = real_estate['calculatedTotalRent']['totalRent']['value']
+        built_in_kitchen = real_estate['builtInKitchen']
+        have_balcony = real_estate['balcony']
+        room_number = real_estate['numberOfRooms']
+        raw_score = (20 * (size/hot_rent)) + (0.5 if built_in_kitchen else 0) + (0.5 if have_balcony else 0) + (4 * (1/distance_center)) + (room_number/8)
+        if location_features is not None:
+            raw_score += self._location_scorer.get_score(location_features)
+        normalized_score = raw_score * 100 + picture_number
+
+        processed_entry = self._build_processed_entry(entry, picture_number, distance_center, normalized_score,
+                                                      apartment_coordinates, location_features)
+        return entry_id, processed_entry, {}
+
+    def _get_coordinates(self, address, entry_id=None):
+        if self._location_scorer is not None:
+            # Listings without coordinates are placed with the geocoding table when it is configured
+            return self._location_scorer.resolve_coordinates(address, entry_id)
+        if 'wgs84Coordinate' in address:
+            return address['wgs84Coordinate']['latitude'], address['wgs84Coordinate']['longitude']
+        return 0, 0
+
+    def save_location_data(self):
+        """
+        Keeps the geocoding table learned in the run, when the location scoring is configured
+        """
+        if self._location_scorer is not None:
+            self._location_scorer.save()
+
+    def _build_processed_entry(self, entry, picture_number, distance_center, normalized_score, coordinates,
+                               location_features=None):
+        entry_id = entry['@id']
+        title = entry['resultlist.realEstate']['title']
+        # Process address
+        address = entry['resultlist.realEstate']['address']
+        latitude, longitude = coordinates
+        quarter = address['quarter']
         # Process main apartment features
         cold_rent = entry['resultlist.realEstate']['price']['value']
         hot_rent = entry['resultlist.realEstate']['calculatedTotalRent']['totalRent']['value']
@@ -138,41 +574,46 @@ class ImmoManager:
             energy_efficiency = entry['resultlist.realEstate']['energyEfficiencyClass']
         else:
             energy_efficiency = 'Not available'
-        # Process contact information
-        contact = entry['resultlist.realEstate']['contactDetails']
-        if 'portraitUrl' in contact:
-            del contact['portraitUrl']
-        if 'portraitUrlForResultList' in contact:
-            del contact['portraitUrlForResultList']
         # Get key dates
         publish_date = entry['@publishDate']
         timestamp = datetime.datetime.now()
-        # Calculate total apartment score
-        raw_score = (20 * (size/hot_rent)) + (0.5 if built_in_kitchen else 0) + (0.5 if have_balcony else 0) + (4 * (1/distance_center)) + (room_number/8)
-        normalized_score = raw_score * 100 + picture_number
 
-        processed_entry = {
-            'opinion': '', # temporal usage as i need one empty space in the google sheet
-            'application_state': 'Abierto',
-            'score': normalized_score,
-            'cold_rent': cold_rent,
-            'hot_rent': hot_rent,
-            'size': size,
-            'room_number': room_number,
-            'quarter': quarter,
-            'distance_center': distance_center,
-            'built_in_kitchen': built_in_kitchen,
-            'have_balcony': have_balcony,
-            'url': f'https://www.immobilienscout24.de/expose/{entry_id}',
-            'number_of_pics': picture_number,
-            'energy_efficiency': energy_efficiency,
-            'maps_url': f'https://www.google.com/maps/@{latitude},{longitude},18z',
-            'address': str(address),
-            'contact': str(contact),
-            'title': title,
-            'id': entry_id,
-            'publish_date': str(publish_date),
-            'timestamp': str(timestamp)
-        }
+        # Only the extracted values are kept, nothing references the raw search result
+        return Listing(
+            score=normalized_score,
+            cold_rent=cold_rent,
+            hot_rent=hot_rent,
+            size=size,
+            room_number=room_number,
+            quarter=quarter,
+            distance_center=distance_center,
+            built_in_kitchen=built_in_kitchen,
+            have_balcony=have_balcony,
+            url=f'https://www.immobilienscout24.de/expose/{entry_id}',
+            number_of_pics=picture_number,
+            energy_efficiency=energy_efficiency,
+            maps_url=f'https://www.google.com/maps/@{latitude},{longitude},18z',
+            address=self._format_address(address),
+            contact=self._format_contact(entry['resultlist.realEstate'].get('contactDetails', {})),
+            title=title,
+            id=entry_id,
+            publish_date=str(publish_date),
+            timestamp=str(timestamp),
+            # The location features go after the original columns so the existing sheets keep their layout
+            location_features=location_features
+        )
 
-        return entry_id, processed_entry, {}
\ No newline at end of file
+    @staticmethod
+    def _format_address(address):
+        if 'description' in address and address['description'].get('text'):
+            return address['description']['text']
+        street = ' '.join(str(address[key]) for key in ('street', 'houseNumber') if address.get(key))
+        city = ' '.join(str(address[key]) for key in ('postcode', 'city') if address.get(key))
+        return ', '.join(part for part in (street, city, address.get('quarter')) if part)
+
+    @staticmethod
+    def _format_contact(contact):
+        # The portraits and the other links of the contact are not needed
+        name = ' '.join(contact[key] for key in ('firstname', 'lastname') if contact.get(key))
+        phones = [contact[key] for key in ('phoneNumber', 'cellPhoneNumber') if contact.get(key)]
+        return ', '.join(part for part in [name, contact.get('company')] + phones if part)
@@ -0,0 +1,110 @@
+import numpy as np
+from src.commons.RuleEngine import RuleEngine
+
+
+class _ListingValues:
+    """
+    Read only view of the realEstate map of a listing plus its picture_number, the evaluated values are looked up in
+    place so nothing of the listing is copied
+    """
+
+    __slots__ = ('_real_estate', '_picture_number')
+
+    def __init__(self, real_estate, picture_number):
+        self._real_estate = real_estate
+        self._picture_number = picture_number
+
+    def __getitem__(self, key):
+        if key == 'picture_number':
+            return self._picture_number
+        return self._real_estate[key]
+
+
+class ListingFilter:
+    """
+    Rejection rules of the search listings, compiled once with the RuleEngine. The default rules reject the exchange
+    offers (E001), the ones requiring WBS (E002) and the ones with too few pictures (E003), the first two can be
+    disabled and more rules can be added with their own codes. The rules are evaluated over the realEstate map of the
+    listing plus its picture_number, in declaration order, and the first one that holds gives the rejection code.
+    The default rules can also be evaluated for a whole list of listings at once with NumPy masks.
+    """
+
+    _include_exchange = False
+    _include_wbs = False
+    _min_pictures = 5
+
+    _configuration = None
+    _rule_engine = None
+    _extra_rule_engine = None
+    _title_rules = None
+    _messages = None
+
+    def __init__(self, configuration):
+        """
+        Constructor using standard a configuation map
+
+        :param configuration:
+        """
+        self._configuration = configuration
+        if 'include_exchange' in configuration:
+            self._include_exchange = configuration['include_exchange']
+        if 'include_wbs' in configuration:
+            self._include_wbs = configuration['include_wbs']
+        if 'min_pictures' in configuration:
+            self._min_pictures = configuration['min_pictures']
+
+        rules = []
+        # (code, lowercase text) of the default title rules, in declaration order
+        self._title_rules = []
+        if not self._include_exchange:
+            self._title_rules.append(('E001', 'tauschwohnung'))
+            rules.append({'code': 'E001', 'message': 'Exchange entries are not valid',
+                          'conditions': [{'field': 'title', 'op': 'contains', 'value': 'tauschwohnung'}]})
+        if not self._include_wbs:
+            self._title_rules.append(('E002', 'wbs'))
+            rules.append({'code': 'E002', 'message': 'WBS entries are not valid',
+                          'conditions': [{'field': 'title', 'op': 'contains', 'value': 'wbs'}]})
+        rules.append({'code': 'E003', 'message': 'Too low number of pictures',
+                      'conditions': [{'field': 'picture_number', 'op': '<', 'value': self._min_pictures}]})
+        extra_rules = configuration.get('rules', [])
+        rules.extend(extra_rules)
+        self._rule_engine = RuleEngine({rule['code']: rule['conditions'] for rule in rules})
+        if extra_rules:
+            self._extra_rule_engine = RuleEngine({rule['code']: rule['conditions'] for rule in extra_rules})
+        self._messages = {rule['code']: rule.get('message', '') for rule in rules}
+
+    def get_rejection(self, real_estate, picture_number):
+        """
+        :param real_estate: the realEstate map of the listing
+        :param picture_number: the number of pictures of the listing
+        :return: map with the code and message of the rejection, or None if the listing is valid
+        """
+        code = self._rule_engine.first_match(_ListingValues(real_estate, picture_number))
+        if code is None:
+            return None
+        return {'code': code, 'message': self._messages[code]}
+
+    def get_rejection_codes(self, real_estates, picture_number):
+        """
+        Same rejections as get_rejection for a list of listings. The default rules are evaluated with NumPy masks over
+        all the titles and picture numbers, only the configured rules are evaluated per listing, and only for the
+        listings that no default rule rejects.
+
+        :param real_estates: list with the realEstate maps of the listings
+        :param picture_number: array with the number of pictures of every listing
+        :return: array with the rejection code of every listing, '' for the valid ones
+        """
+        # Same values as the contains operator of the RuleEngine, a missing title never matches
+        titles = np.char.lower(np.array(['' if real_estate.get('title') is None else str(real_estate['title'])
+                                         for real_estate in real_estates], dtype=str))
+        masks = [np.char.find(titles, text) >= 0 for code, text in self._title_rules]
+        masks.append(picture_number < self._min_pictures)
+        codes = [code for code, text in self._title_rules] + ['E003']
+        reject_code = np.select(masks, codes, default='').astype(object)
+        if self._extra_rule_engine is not None:
+            for index in np.flatnonzero(reject_code == ''):
+                code = self._extra_rule_engine.first_match(_ListingValues(real_estates[index],
+                                                                          int(picture_number[index])))
+                if code is not None:
+                    reject_code[index] = code
+        return reject_code.astype(str)
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class SearchResponseCache:
+    """
+    On disk cache of the search responses. Every url keeps its body and a small metadata file with the ETag and
+    Last-Modified validators, the time it was stored and the fingerprint of the listings processed in the last run.
+    The bodies are evicted in least recently used order once the cache grows over its size limit.
+    """
+
+    _cache_directory = '.search_cache'
+    _ttl_seconds = 60
+    _max_size_bytes = 50 * 1024 * 1024
+
+    _configuration = None
+    _lock = None
+
+    def __init__(self, configuration):
+        """
+        Constructor using standard a configuation map
+
+        :param configuration:
+        """
+        self._configuration = configuration
+        if 'cache_directory' in configuration:
+            self._cache_directory = configuration['cache_directory']
+        if 'ttl_seconds' in configuration:
+            self._ttl_seconds = configuration['ttl_seconds']
+        if 'max_size_bytes' in configuration:
+            self._max_size_bytes = configuration['max_size_bytes']
+        self._lock = threading.Lock()
+        os.makedirs(self._cache_directory, exist_ok=True)
+
+    def _get_paths(self, url):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self._cache_directory, f'{key}.body'), os.path.join(self._cache_directory, f'{key}.meta.json')
+
+    def _read_metadata(self, url):
+        body_path, metadata_path = self._get_paths(url)
+        try:
+            with open(metadata_path) as metadata_file:
+                return json.load(metadata_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_metadata(self, url, metadata):
+        body_path, metadata_path = self._get_paths(url)
+        with open(metadata_path, 'w') as metadata_file:
+            json.dump(metadata, metadata_file)
+
+    def get(self, url):
+        """
+        :param url: the requested url
+        :return: map with the body, the validators and stored_at, or None if the body is not cached
+        """
+        body_path, metadata_path = self._get_paths(url)
+        metadata = self._read_metadata(url)
+        try:
+            with open(body_path, 'rb') as body_file:
+                body = body_file.read()
+        except OSError:
+            return None
+        # The modification time of the body is the last access used by the eviction
+        os.utime(body_path)
+        return dict(metadata, body=body)
+
+    def is_fresh(self, cached_response):
+        return time.time() - cached_response.get('stored_at', 0) < self._ttl_seconds
+
+    @staticmethod
+    def get_validation_headers(cached_response):
+        headers = {}
+        if cached_response.get('etag'):
+            headers['If-None-Match'] = cached_response['etag']
+        if cached_response.get('last_modified'):
+            headers['If-Modified-Since'] = cached_response['last_modified']
+        return headers
+
+    def store(self, url, body, etag=None, last_modified=None):
+        body_path, metadata_path = self._get_paths(url)
+        with self._lock:
+            metadata = self._read_metadata(url)
+            metadata.update({'url': url, 'etag': etag, 'last_modified': last_modified, 'stored_at': time.time()})
+            with open(body_path, 'wb') as body_file:
+                body_file.write(body)
+            self._write_metadata(url, metadata)
+            self._evict()
+
+    def refresh(self, url):
+        # The server confirmed the cached body is still valid
+        with self._lock:
+            metadata = self._read_metadata(url)
+            metadata['stored_at'] = time.time()
+            self._write_metadata(url, metadata)
+
+    def get_fingerprint(self, url):
+        return self._read_metadata(url).get('fingerprint')
+
+    def set_fingerprint(self, url, fingerprint):
+        with self._lock:
+            metadata = self._read_metadata(url)
+            metadata.update({'url': url, 'fingerprint': fingerprint})
+            self._write_metadata(url, metadata)
+
+    def _evict(self):
+        bodies = []
+        for file_name in os.listdir(self._cache_directory):
+            if file_name.endswith('.body'):
+                path = os.path.join(self._cache_directory, file_name)
+                file_stat = os.stat(path)
+                bodies.append((file_stat.st_mtime, file_stat.st_size, path))
+        total_size = sum(size for modified_at, size, path in bodies)
+        for modified_at, size, path in sorted(bodies):
+            if total_size <= self._max_size_bytes:
+                break
+            # Only the body is removed, the fingerprint of the last run is kept
+            os.remove(path)
+            total_size -= size
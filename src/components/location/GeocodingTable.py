@@ -0,0 +1,144 @@
+import csv
+import datetime
+import json
+import os
+import threading
+from src.commons.FileUtils import FileUtils
+
+
+class GeocodingTable:
+    """
+    Fallback coordinates for the listings published without wgs84Coordinate. The coordinates are looked up by
+    postcode and then by quarter. The table can be seeded with a CSV file and it learns the mean position of every
+    postcode and quarter from the listings that have coordinates, every listing is learned only once however many runs
+    see it. The learned table is kept in a JSON cache file, so no geocoding service is needed. The learned ids are
+    kept with the date they were last seen and forgotten once their listing is gone for a while.
+    """
+
+    _cache_file = None
+    _seed_file = None
+    # The seed rows are known centroids, e.g. from an official postcode list, and weigh like many listings
+    _seed_weight = 100
+    _learned_ids_days = 90
+
+    _configuration = None
+    _locations = None
+    _learned_ids = None
+    _lock = None
+    _changed = False
+
+    def __init__(self, configuration):
+        """
+        Constructor using standard a configuation map
+
+        :param configuration:
+        """
+        self._configuration = configuration
+        if 'cache_file' in configuration:
+            self._cache_file = configuration['cache_file']
+        if 'seed_file' in configuration:
+            self._seed_file = configuration['seed_file']
+        if 'learned_ids_days' in configuration:
+            self._learned_ids_days = configuration['learned_ids_days']
+        self._lock = threading.Lock()
+        # Every key maps to [latitude sum, longitude sum, number of listings]
+        self._locations = {}
+        # Every learned id maps to the ISO date it was last seen
+        self._learned_ids = {}
+        if self._seed_file:
+            self._load_seed_file(self._seed_file)
+        if self._cache_file and os.path.exists(self._cache_file):
+            self._load_cache_file(self._cache_file)
+
+    def _load_cache_file(self, cache_file_path):
+        try:
+            with open(cache_file_path) as cache_file:
+                cache = json.load(cache_file)
+            if not isinstance(cache, dict):
+                raise ValueError('the cache is not a JSON object')
+        except (OSError, ValueError) as error:
+            # A damaged cache is replaced on the next save, the listings with coordinates teach the table again
+            print(f'WARNING:: The geocoding cache could not be used: {error}')
+            return
+        today = datetime.date.today().isoformat()
+        # The first cache files only had the locations, and the next ones a list with the learned ids
+        if 'locations' in cache and 'learned_ids' in cache:
+            self._locations.update(cache['locations'])
+            learned_ids = cache['learned_ids']
+            if isinstance(learned_ids, dict):
+                self._learned_ids.update(learned_ids)
+            else:
+                self._learned_ids.update((listing_id, today) for listing_id in learned_ids)
+        else:
+            self._locations.update(cache)
+
+    def _load_seed_file(self, seed_file):
+        with open(seed_file, newline='') as csv_file:
+            for row in csv.DictReader(csv_file):
+                self._locations[self._get_key(row['key'])] = [float(row['latitude']) * self._seed_weight,
+                                                              float(row['longitude']) * self._seed_weight,
+                                                              self._seed_weight]
+
+    @staticmethod
+    def _get_key(value):
+        return str(value).strip().lower()
+
+    def get_coordinates(self, address):
+        """
+        :param address: the address map of a listing
+        :return: tuple (latitude, longitude) of the postcode or the quarter, or None if both are unknown
+        """
+        for field in ('postcode', 'quarter'):
+            if field not in address:
+                continue
+            location = self._locations.get(self._get_key(address[field]))
+            if location is not None:
+                return location[0] / location[2], location[1] / location[2]
+        return None
+
+    def learn(self, address, latitude, longitude, listing_id=None):
+        """
+        Adds the coordinates of a listing to the mean position of its postcode and quarter
+
+        :param address: the address map of the listing
+        :param latitude: latitude of the listing
+        :param longitude: longitude of the listing
+        :param listing_id: id of the listing, the listings already learned are ignored
+        """
+        with self._lock:
+            if listing_id is not None:
+                # The same listing shows up on every run while it is published, it must not outweigh the rest
+                today = datetime.date.today().isoformat()
+                last_seen = self._learned_ids.get(str(listing_id))
+                self._learned_ids[str(listing_id)] = today
+                if last_seen is not None:
+                    self._changed = self._changed or last_seen != today
+                    return
+            for field in ('postcode', 'quarter'):
+                if field not in address:
+                    continue
+                location = self._locations.setdefault(self._get_key(address[field]), [0.0, 0.0, 0])
+                location[0] += latitude
+                location[1] += longitude
+                location[2] += 1
+                self._changed = True
+
+    def save(self):
+        """
+        Writes the learned table into the cache file, when it is configured and something changed. The ids not seen
+        for learned_ids_days are forgotten.
+        """
+        if not self._cache_file or not self._changed:
+            return
+        with self._lock:
+            oldest_date = (datetime.date.today() - datetime.timedelta(days=self._learned_ids_days)).isoformat()
+            self._learned_ids = {listing_id: last_seen for listing_id, last_seen in self._learned_ids.items()
+                                 if last_seen >= oldest_date}
+            try:
+                FileUtils.write_file_atomically(self._cache_file, json.dumps({'locations': self._locations,
+                                                                              'learned_ids': self._learned_ids}))
+            except OSError as error:
+                # The table is kept in memory, the next save tries again
+                print(f'WARNING:: The geocoding cache could not be stored: {error}')
+                return
+            self._changed = False
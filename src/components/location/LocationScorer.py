@@ -0,0 +1,141 @@
+import numpy as np
+from src.components.location.GeocodingTable import GeocodingTable
+from src.components.location.PoiIndex import PoiIndex
+
+
+class LocationScorer:
+    """
+    Location features and score of the apartments against the configured points of interest. Every feature is either
+    the distance to the nearest point of a category or the number of points of a category within a radius, e.g.
+
+        {'name': 'station_km', 'category': 'station', 'type': 'nearest', 'weight': 2}
+        {'name': 'schools_1km', 'category': 'school', 'type': 'count', 'radius_km': 1, 'weight': 0.1}
+
+    The nearest distances add weight / distance to the raw score, like the distance to the center does, and the
+    counts add weight * count. The features are precomputed per position, so the listings repeated along the searches
+    and the runs do not query the index again. The listings without coordinates are placed with the geocoding table.
+    """
+
+    _features = None
+    _max_distance_km = 20
+    _feature_cache_size = 100000
+    # Positions are rounded to about 1 m for the feature cache
+    _coordinate_precision = 5
+
+    _configuration = None
+    _poi_index = None
+    _geocoding_table = None
+    _feature_cache = None
+
+    def __init__(self, configuration):
+        """
+        Constructor using standard a configuation map
+
+        :param configuration:
+        """
+        self._configuration = configuration
+        self._features = list(configuration.get('features', []))
+        if 'max_distance_km' in configuration:
+            self._max_distance_km = configuration['max_distance_km']
+        if 'feature_cache_size' in configuration:
+            self._feature_cache_size = configuration['feature_cache_size']
+        self._poi_index = PoiIndex(configuration.get('PoiIndex', {}))
+        if 'GeocodingTable' in configuration:
+            self._geocoding_table = GeocodingTable(configuration['GeocodingTable'])
+        self._feature_cache = {}
+
+    def get_feature_names(self):
+        return [feature['name'] for feature in self._features]
+
+    def resolve_coordinates(self, address, listing_id=None):
+        """
+        :param address: the address map of a listing
+        :param listing_id: id of the listing, so the geocoding table learns every listing once
+        :return: tuple (latitude, longitude) of the listing, from the geocoding table if it has no coordinates, or
+                 (0, 0) when it is unknown
+        """
+        if 'wgs84Coordinate' in address:
+            latitude, longitude = address['wgs84Coordinate']['latitude'], address['wgs84Coordinate']['longitude']
+            if self._geocoding_table is not None:
+                self._geocoding_table.learn(address, latitude, longitude, listing_id)
+            return latitude, longitude
+        if self._geocoding_table is not None:
+            coordinates = self._geocoding_table.get_coordinates(address)
+            if coordinates is not None:
+                return coordinates
+        return 0, 0
+
+    def get_features(self, latitude, longitude):
+        """
+        :param latitude: latitude of the listing
+        :param longitude: longitude of the listing
+        :return: map with the value of every feature, the distances are None if there is no point in reach
+        """
+        if not (latitude > 0 and longitude > 0):
+            return {feature['name']: None if feature['type'] == 'nearest' else 0 for feature in self._features}
+        key = (round(latitude, self._coordinate_precision), round(longitude, self._coordinate_precision))
+        features = self._feature_cache.get(key)
+        if features is not None:
+            return features
+
+        features = {}
+        for feature in self._features:
+            if feature['type'] == 'nearest':
+                distance, name = self._poi_index.nearest(latitude, longitude, feature['category'],
+                                                         feature.get('max_distance_km', self._max_distance_km))
+                features[feature['name']] = distance
+            elif feature['type'] == 'count':
+                features[feature['name']] = self._poi_index.count_within(latitude, longitude, feature['category'],
+                                                                         feature['radius_km'])
+            else:
+                raise ValueError(f'The feature type {feature["type"]} is not supported')
+        if len(self._feature_cache) >= self._feature_cache_size:
+            self._feature_cache.clear()
+        self._feature_cache[key] = features
+        return features
+
+    def get_features_and_scores(self, latitude, longitude):
+        """
+        Same features and scores as get_features and get_score for many positions, e.g. the listings of a page. The
+        repeated positions are looked up once, and the score terms are added per feature over all the positions.
+
+        :param latitude: array with the latitudes
+        :param longitude: array with the longitudes
+        :return: tuple with the list of feature maps and the array of location terms of the raw score
+        """
+        positions, position_indexes = np.unique(np.column_stack((latitude, longitude)), axis=0, return_inverse=True)
+        position_features = [self.get_features(position_latitude, position_longitude)
+                             for position_latitude, position_longitude in positions.tolist()]
+        features = [position_features[index] for index in position_indexes.reshape(-1)]
+        score = np.zeros(len(features))
+        for feature in self._features:
+            values = np.array([position_features[index][feature['name']] for index in range(len(positions))],
+                              dtype=float)[position_indexes.reshape(-1)]
+            # Same terms as get_score, the missing distances are NaN and add nothing
+            if feature['type'] == 'nearest':
+                terms = feature.get('weight', 1) / np.maximum(values, 0.1)
+            else:
+                terms = feature.get('weight', 1) * values
+            score += np.where(np.isnan(values), 0, terms)
+        return features, score
+
+    def get_score(self, features):
+        """
+        :param features: map of feature values as returned by get_features
+        :return: the location term of the raw score
+        """
+        score = 0
+        for feature in self._features:
+            value = features[feature['name']]
+            if value is None:
+                continue
+            if feature['type'] == 'nearest':
+                # Closer than 100 m counts as 100 m, so a point next door does not dominate the score
+                score += feature.get('weight', 1) / max(value, 0.1)
+            else:
+                score += feature.get('weight', 1) * value
+        return score
+
+    def save(self):
+        if self._geocoding_table is not None:
+            self._geocoding_table.save()
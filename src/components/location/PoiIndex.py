@@ -0,0 +1,159 @@
+import csv
+import json
+import math
+from collections import defaultdict
+from haversine import haversine
+
+
+class PoiIndex:
+    """
+    Grid index of points of interest, e.g. offices, stations or schools. The points are bucketed in cells of a fixed
+    size in km, so the nearest and the within radius queries only look at the cells around the query point instead
+    of every point. The points are loaded from GeoJSON or CSV files and indexed per category.
+    """
+
+    _cell_size_km = 1.0
+    # Length of one degree of latitude, the cells use the same size in degrees for the longitude
+    _km_per_degree = 111.32
+
+    _configuration = None
+    _cells = None
+    _bounds = None
+    _number_of_points = 0
+
+    def __init__(self, configuration):
+        """
+        Constructor using standard a configuation map
+
+        :param configuration:
+        """
+        self._configuration = configuration
+        if 'cell_size_km' in configuration:
+            self._cell_size_km = configuration['cell_size_km']
+        self._cells = defaultdict(lambda: defaultdict(list))
+        # Bounding box of the cells of every category as [min row, max row, min column, max column]
+        self._bounds = {}
+        if 'poi_files' in configuration:
+            for poi_file in configuration['poi_files']:
+                self.load(poi_file)
+
+    def __len__(self):
+        return self._number_of_points
+
+    def load(self, poi_file, category=None):
+        """
+        Loads the points of a GeoJSON file with Point features, or of a CSV file with the latitude and longitude
+        columns. The category is read from the category property or column, when there is none the given category or
+        the file name is used.
+
+        :param poi_file: path of the .geojson, .json or .csv file
+        :param category: default category of the points
+        """
+        category = category or poi_file.rsplit('/', 1)[-1].split('.')[0]
+        if poi_file.endswith('.csv'):
+            with open(poi_file, newline='') as csv_file:
+                for row in csv.DictReader(csv_file):
+                    self.add_point(float(row['latitude']), float(row['longitude']), row.get('category') or category,
+                                   row.get('name', ''))
+        else:
+            with open(poi_file) as geojson_file:
+                features = json.load(geojson_file)['features']
+            for feature in features:
+                if feature.get('geometry', {}).get('type') != 'Point':
+                    continue
+                # GeoJSON coordinates are in longitude, latitude order
+                longitude, latitude = feature['geometry']['coordinates'][:2]
+                properties = feature.get('properties') or {}
+                self.add_point(latitude, longitude, properties.get('category') or category, properties.get('name', ''))
+        print(f'INFO:: {self._number_of_points} points of interest indexed')
+
+    def add_point(self, latitude, longitude, category, name=''):
+        row, column = self._get_cell(latitude, longitude)
+        self._cells[category][(row, column)].append((latitude, longitude, name))
+        bounds = self._bounds.setdefault(category, [row, row, column, column])
+        bounds[:] = [min(bounds[0], row), max(bounds[1], row), min(bounds[2], column), max(bounds[3], column)]
+        self._number_of_points += 1
+
+    def get_categories(self):
+        return list(self._cells.keys())
+
+    def nearest(self, latitude, longitude, category, max_distance_km=None):
+        """
+        Finds the nearest point of the category. The rings of cells around the query are visited until no point
+        outside of them can be nearer than the best found.
+
+        :param latitude: latitude of the query point
+        :param longitude: longitude of the query point
+        :param category: the category of the points
+        :param max_distance_km: the search stops at this distance, unlimited by default
+        :return: tuple (distance in km, name), or (None, None) if there is no point
+        """
+        cells = self._cells.get(category)
+        if not cells:
+            return None, None
+        row, column = self._get_cell(latitude, longitude)
+        cell_size_km = self._get_min_cell_size_km(latitude)
+        max_ring = self._get_max_ring(category, row, column, latitude, max_distance_km)
+        best_distance, best_name = None, None
+        for ring in range(max_ring + 1):
+            # Any point out of the visited rings is at least this far away
+            if best_distance is not None and best_distance <= (ring - 1) * cell_size_km:
+                break
+            for cell in self._get_ring_cells(row, column, ring):
+                for point_latitude, point_longitude, name in cells.get(cell, ()):
+                    distance = haversine((latitude, longitude), (point_latitude, point_longitude))
+                    if best_distance is None or distance < best_distance:
+                        best_distance, best_name = distance, name
+        if best_distance is not None and max_distance_km is not None and best_distance > max_distance_km:
+            return None, None
+        return best_distance, best_name
+
+    def count_within(self, latitude, longitude, category, radius_km):
+        """
+        :param latitude: latitude of the query point
+        :param longitude: longitude of the query point
+        :param category: the category of the points
+        :param radius_km: the radius in km
+        :return: the number of points of the category within the radius
+        """
+        cells = self._cells.get(category)
+        if not cells:
+            return 0
+        row, column = self._get_cell(latitude, longitude)
+        rings = int(math.ceil(radius_km / self._get_min_cell_size_km(latitude)))
+        count = 0
+        for row_offset in range(-rings, rings + 1):
+            for column_offset in range(-rings, rings + 1):
+                for point_latitude, point_longitude, name in cells.get((row + row_offset, column + column_offset), ()):
+                    if haversine((latitude, longitude), (point_latitude, point_longitude)) <= radius_km:
+                        count += 1
+        return count
+
+    def _get_cell(self, latitude, longitude):
+        # The cells have a fixed size in degrees, the one of the longitude is taken at the equator
+        cell_degrees = self._cell_size_km / self._km_per_degree
+        return int(math.floor(latitude / cell_degrees)), int(math.floor(longitude / cell_degrees))
+
+    def _get_min_cell_size_km(self, latitude):
+        # The cells get narrower with the latitude, the narrowest side bounds the distances covered by a ring
+        return self._cell_size_km * max(math.cos(math.radians(min(abs(latitude) + 1, 89))), 0.01)
+
+    def _get_max_ring(self, category, row, column, latitude, max_distance_km):
+        # The search never goes beyond the farthest indexed cell
+        min_row, max_row, min_column, max_column = self._bounds[category]
+        max_ring = max(row - min_row, max_row - row, column - min_column, max_column - column, 0)
+        if max_distance_km is not None:
+            max_ring = min(max_ring, int(math.ceil(max_distance_km / self._get_min_cell_size_km(latitude))))
+        return max_ring
+
+    @staticmethod
+    def _get_ring_cells(row, column, ring):
+        if ring == 0:
+            yield row, column
+            return
+        for offset in range(-ring, ring + 1):
+            yield row - ring, column + offset
+            yield row + ring, column + offset
+        for offset in range(-ring + 1, ring):
+            yield row + offset, column - ring
+            yield row + offset, column + ring
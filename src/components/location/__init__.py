@@ -0,0 +1,3 @@
+"""
+The location components, points of interest and geocoding used to score the apartments
+"""
\ No newline at end of file
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import sqlite3
+from src.commons.DataManipulationUtils import DataManipulationUtils
+
+
+class ListingStore:
+    """
+    Local and durable index of the listings already written into the sheet. It allows the deduplication to be done
+    with lookups over the new entries instead of reading the whole sheet on every run. It also keeps a content hash
+    and the tracked values of every listing with its sheet row, so the changed listings can be detected and updated
+    in place. The newest publish date seen by every search is kept as well, as the high-water mark of its next crawl.
+    """
+
+    _db_file = 'listings.db'
+    _lookup_chunk_size = 500
+    _in_memory = False
+    _tracked_fields = ['score', 'cold_rent', 'hot_rent', 'size', 'room_number', 'distance_center', 'number_of_pics',
+                       'energy_efficiency', 'title']
+
+    _configuration = None
+    _connection = None
+    _known_ids = None
+
+    def __init__(self, configuration):
+        """
+        Constructor using standard a configuation map
+
+        :param configuration:
+        """
+        self._configuration = configuration
+        if 'db_file' in configuration:
+            self._db_file = configuration['db_file']
+        if 'in_memory' in configuration:
+            self._in_memory = configuration['in_memory']
+        if 'tracked_fields' in configuration:
+            self._tracked_fields = configuration['tracked_fields']
+        self._connection = sqlite3.connect(self._db_file, check_same_thread=False)
+        self._create_schema()
+        if self._in_memory:
+            # Long running processes keep a mirror of the ids, the database stays as the durable copy
+            self._known_ids = {row[0] for row in self._connection.execute('SELECT id FROM listings')}
+
+    def _create_schema(self):
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS listings (id TEXT PRIMARY KEY, publish_date TEXT)'
+            )
+            # Columns added for the change tracking, the stores created before get them on the fly
+            columns = {row[1] for row in self._connection.execute('PRAGMA table_info(listings)')}
+            for column, column_type in (('content_hash', 'TEXT'), ('tracked_values', 'TEXT'), ('row_number', 'INTEGER')):
+                if column not in columns:
+                    self._connection.execute(f'ALTER TABLE listings ADD COLUMN {column} {column_type}')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS search_marks (search_url TEXT PRIMARY KEY, high_water_date TEXT)'
+            )
+
+    def __len__(self):
+        if self._known_ids is not None:
+            return len(self._known_ids)
+        return self._connection.execute('SELECT COUNT(*) FROM listings').fetchone()[0]
+
+    def __contains__(self, entry_id):
+        if self._known_ids is not None:
+            return str(entry_id) in self._known_ids
+        cursor = self._connection.execute('SELECT 1 FROM listings WHERE id = ?', (str(entry_id),))
+        return cursor.fetchone() is not None
+
+    def get_unknown_ids(self, entry_ids):
+        """
+        Filters the given ids keeping the ones not stored yet, the input order is kept
+
+        :param entry_ids: iterable of listing ids
+        :return: list with the ids that are not in the store
+        """
+        entry_ids = [str(entry_id) for entry_id in entry_ids]
+        if self._known_ids is not None:
+            return [entry_id for entry_id in entry_ids if entry_id not in self._known_ids]
+        known_ids = set()
+        for start in range(0, len(entry_ids), self._lookup_chunk_size):
+            chunk = entry_ids[start:start + self._lookup_chunk_size]
+            placeholders = ','.join('?' * len(chunk))
+            cursor = self._connection.execute(f'SELECT id FROM listings WHERE id IN ({placeholders})', chunk)
+            known_ids.update(row[0] for row in cursor)
+        return [entry_id for entry_id in entry_ids if entry_id not in known_ids]
+
+    def get_high_water_dates(self):
+        """
+        :return: map of search urls to the newest publish date seen by the search, as timezone aware datetimes
+        """
+        return {row[0]: DataManipulationUtils.parse_publish_date(row[1])
+                for row in self._connection.execute('SELECT search_url, high_water_date FROM search_marks')}
+
+    def set_high_water_dates(self, publish_dates):
+        """
+        Moves the high-water mark of the given searches forward, a mark never goes back
+
+        :param publish_dates: map of search urls to the newest publish date of their stored listings, ISO strings or
+                              datetimes
+        """
+        stored_dates = self.get_high_water_dates()
+        rows = []
+        for search_url, publish_date in publish_dates.items():
+            # The dates are compared as datetimes, the strings do not sort across the daylight saving time offsets
+            publish_date = DataManipulationUtils.parse_publish_date(publish_date)
+            stored_date = stored_dates.get(search_url)
+            if publish_date is not None and (stored_date is None or publish_date > stored_date):
+                rows.append((search_url, publish_date.isoformat()))
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO search_marks (search_url, high_water_date) VALUES (?, ?)', rows
+            )
+
+    def add_entries(self, entries, first_row=None):
+        """
+        Stores the given processed entries, entries already known are ignored
+
+        :param entries: iterable of maps with at least the id and publish_date keys
+        :param first_row: sheet row of the first entry, the rest are expected in the following rows
+        """
+        rows = []
+        for index, entry in enumerate(entries):
+            content_hash, tracked_values = self._get_content_state(entry)
+            row_number = first_row + index if first_row is not None else None
+            rows.append((str(entry['id']), str(entry.get('publish_date', '')), content_hash, tracked_values, row_number))
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO listings (id, publish_date, content_hash, tracked_values, row_number) '
+                'VALUES (?, ?, ?, ?, ?)', rows
+            )
+        if self._known_ids is not None:
+            self._known_ids.update(row[0] for row in rows)
+
+    def detect_changes(self, entries):
+        """
+        Compares the tracked fields of the given known entries with the stored ones and stores the new state. The
+        entries without a stored state, e.g. after a reconcile, only get their state stored.
+
+        :param entries: iterable of processed entries that are already stored
+        :return: list of (entry, row_number, changes) where changes maps every changed field to its (old, new) values
+        """
+        entries = {str(entry['id']): entry for entry in entries}
+        stored_states = {}
+        entry_ids = list(entries.keys())
+        for start in range(0, len(entry_ids), self._lookup_chunk_size):
+            chunk = entry_ids[start:start + self._lookup_chunk_size]
+            placeholders = ','.join('?' * len(chunk))
+            cursor = self._connection.execute(
+                f'SELECT id, content_hash, tracked_values, row_number FROM listings WHERE id IN ({placeholders})', chunk
+            )
+            stored_states.update({row[0]: row[1:] for row in cursor})
+
+        changed_entries = []
+        updated_states = []
+        for entry_id, entry in entries.items():
+            if entry_id not in stored_states:
+                continue
+            stored_hash, stored_values, row_number = stored_states[entry_id]
+            content_hash, tracked_values = self._get_content_state(entry)
+            # The hash is compared first, the values are only decoded for the changed listings
+            if content_hash == stored_hash:
+                continue
+            updated_states.append((content_hash, tracked_values, entry_id))
+            if stored_hash is None:
+                continue
+            old_values, new_values = json.loads(stored_values), json.loads(tracked_values)
+            changes = {field: (old_values.get(field), new_values.get(field)) for field in self._tracked_fields
+                       if old_values.get(field) != new_values.get(field)}
+            changed_entries.append((entry, row_number, changes))
+
+        with self._connection:
+            self._connection.executemany(
+                'UPDATE listings SET content_hash = ?, tracked_values = ? WHERE id = ?', updated_states
+            )
+        return changed_entries
+
+    def _get_content_state(self, entry):
+        tracked_values = json.dumps({field: entry.get(field) for field in self._tracked_fields}, sort_keys=True, default=str)
+        return hashlib.sha1(tracked_values.encode()).hexdigest()[:16], tracked_values
+
+    def reconcile(self, entries):
+        """
+        Replaces the content of the store with the given entries, usually the content of the sheet. The content
+        state is unknown after a reconcile and it is stored again the next time the listings are seen. The high-water
+        marks are dropped as well, the listings missing in the sheet may be older than them.
+
+        :param entries: iterable of maps with at least the id and publish_date keys, and optionally the row_number
+        """
+        rows = [(str(entry['id']), str(entry.get('publish_date', '')), entry.get('row_number')) for entry in entries]
+        with self._connection:
+            self._connection.execute('DELETE FROM listings')
+            self._connection.execute('DELETE FROM search_marks')
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO listings (id, publish_date, row_number) VALUES (?, ?, ?)', rows
+            )
+        if self._known_ids is not None:
+            self._known_ids = {row[0] for row in rows}
+        print(f'INFO:: The listing store was reconciled with {len(rows)} entries')
+
+    def relocate(self, entries):
+        """
+        Replaces the sheet rows of the stored listings, e.g. after the sheet was sorted or some rows were deleted. The
+        content state is kept, the listings that are not given lose their row.
+
+        :param entries: iterable of maps with the id and row_number keys, usually the id column of the sheet
+        """
+        rows = [(entry['row_number'], str(entry['id'])) for entry in entries]
+        with self._connection:
+            self._connection.execute('UPDATE listings SET row_number = NULL')
+            self._connection.executemany('UPDATE listings SET row_number = ? WHERE id = ?', rows)
+        print(f'INFO:: The rows of the listing store were relocated with {len(rows)} entries')
+
+    def close(self):
+        self._connection.close()
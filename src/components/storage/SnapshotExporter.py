@@ -0,0 +1,167 @@
+import datetime
+import gzip
+import json
+import os
+
+
+class SnapshotExporter:
+    """
+    Keeps the history of the market: every run appends a snapshot with all the listings it processed, the valid ones
+    and the rejected ones with their reason code, to a file of its own partitioned by date, e.g.
+    snapshots/date=2021-09-12/run-20210912T100000-42.jsonl.gz. The files are never rewritten, so a run only costs the
+    write of its own listings, and they are written in batches while the run goes on. The snapshots are written as
+    Parquet when pyarrow is installed, and as compressed JSON lines otherwise, see SnapshotQuery to read them.
+    """
+
+    COLUMNS = ('run_at', 'id', 'status', 'reject_code', 'score', 'cold_rent', 'hot_rent', 'size', 'room_number',
+               'quarter', 'distance_center', 'number_of_pics', 'publish_date', 'title')
+    NUMERIC_COLUMNS = frozenset(('score', 'cold_rent', 'hot_rent', 'size', 'room_number', 'distance_center',
+                                 'number_of_pics'))
+
+    _directory = 'snapshots'
+    _format = 'auto'
+    _compression = 'zstd'
+    _batch_size = 1000
+
+    _configuration = None
+    _rows = None
+    _run_at = None
+    _path = None
+    _writer = None
+    _written_rows = 0
+
+    def __init__(self, configuration):
+        """
+        Constructor using standard a configuation map
+
+        :param configuration:
+        """
+        self._configuration = configuration
+        if 'directory' in configuration:
+            self._directory = configuration['directory']
+        if 'format' in configuration:
+            self._format = configuration['format']
+        if 'compression' in configuration:
+            self._compression = configuration['compression']
+        if 'batch_size' in configuration:
+            self._batch_size = max(1, int(configuration['batch_size']))
+        if self._format not in ('auto', 'jsonl', 'parquet'):
+            raise ValueError(f'The snapshot format {self._format} is not supported')
+        if self._format == 'auto':
+            self._format = 'parquet' if self._is_parquet_available() else 'jsonl'
+        self.start_run()
+
+    @staticmethod
+    def _is_parquet_available():
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def start_run(self):
+        """
+        Drops the snapshot of the run not finished yet, and stamps the following listings with the current time
+        """
+        if self._writer is not None:
+            self._writer.close()
+            os.remove(self._path + '.tmp')
+        self._rows = []
+        self._run_at = datetime.datetime.now().replace(microsecond=0)
+        self._path = None
+        self._writer = None
+        self._written_rows = 0
+
+    def add_listings(self, listings):
+        """
+        :param listings: iterable of the processed listings of the run, Listing records or maps with their keys
+        """
+        run_at = self._run_at.isoformat()
+        for listing in listings:
+            self._add_row(self._build_row(listing, run_at, 'valid'))
+
+    def add_rejected(self, entries):
+        """
+        :param entries: iterable of maps with the rejected listings of the run, see ImmoManager.pop_rejected_entries
+        """
+        run_at = self._run_at.isoformat()
+        for entry in entries:
+            self._add_row(self._build_row(entry, run_at, 'rejected'))
+
+    def _add_row(self, row):
+        # Only a batch of rows is kept in memory, the rest is already in the file of the run
+        self._rows.append(row)
+        if len(self._rows) >= self._batch_size:
+            self._flush_rows()
+
+    def _build_row(self, values, run_at, status):
+        row = {'run_at': run_at, 'id': str(values.get('id')), 'status': status}
+        for column in self.COLUMNS[3:]:
+            value = values.get(column)
+            # The types are fixed per column, the rejected listings can have anything in their raw values
+            if value is not None and column in self.NUMERIC_COLUMNS:
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    value = None
+            elif value is not None:
+                value = str(value)
+            row[column] = value
+        return row
+
+    def _flush_rows(self):
+        if not self._rows:
+            return
+        if self._writer is None:
+            self._open_writer()
+        if self._format == 'parquet':
+            import pyarrow as pa
+
+            # Every batch is a row group of the file
+            self._writer.write_table(pa.Table.from_pylist(self._rows, schema=self._writer.schema_arrow))
+        else:
+            self._writer.writelines(json.dumps(row, ensure_ascii=False) + '\n' for row in self._rows)
+        self._written_rows += len(self._rows)
+        self._rows = []
+
+    def _open_writer(self):
+        partition = os.path.join(self._directory, f'date={self._run_at.date().isoformat()}')
+        os.makedirs(partition, exist_ok=True)
+        extension = '.parquet' if self._format == 'parquet' else '.jsonl.gz'
+        # Many processes can write into the same directory, and many runs can start in the same second
+        file_name = f'run-{self._run_at.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}'
+        path = os.path.join(partition, file_name + extension)
+        suffix = 1
+        while os.path.exists(path) or os.path.exists(path + '.tmp'):
+            path = os.path.join(partition, f'{file_name}-{suffix}{extension}')
+            suffix += 1
+        # The file is written under a temporary name and only renamed once complete, so the readers never see a
+        # partial snapshot
+        if self._format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            schema = pa.schema([(column, pa.float64() if column in self.NUMERIC_COLUMNS else pa.string())
+                                for column in self.COLUMNS])
+            self._writer = pq.ParquetWriter(path + '.tmp', schema, compression=self._compression)
+        else:
+            self._writer = gzip.open(path + '.tmp', 'wt', encoding='utf-8')
+        self._path = path
+
+    def write_run(self):
+        """
+        Completes the file of the run with the buffered listings, and starts a new run
+
+        :return: the path of the written file, or None when there was nothing to write
+        """
+        self._flush_rows()
+        if self._writer is None:
+            self.start_run()
+            return None
+        path, written_rows = self._path, self._written_rows
+        self._writer.close()
+        os.replace(path + '.tmp', path)
+        self._writer = None
+        self.start_run()
+        print(f'INFO:: Wrote the snapshot of {written_rows} listings to {path}')
+        return path
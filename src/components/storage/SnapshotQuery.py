@@ -0,0 +1,174 @@
+import datetime
+import gzip
+import json
+import os
+import statistics
+from collections import defaultdict
+
+
+class SnapshotQuery:
+    """
+    Reads the snapshots written by the SnapshotExporter for the market analytics. Only the date partitions within the
+    requested dates are opened, and only the needed columns are read from the Parquet files.
+    """
+
+    _directory = 'snapshots'
+
+    _configuration = None
+
+    def __init__(self, configuration):
+        """
+        Constructor using standard a configuation map
+
+        :param configuration:
+        """
+        self._configuration = configuration
+        if 'directory' in configuration:
+            self._directory = configuration['directory']
+
+    def iterate_rows(self, columns=None, start_date=None, end_date=None, include_rejected=False):
+        """
+        :param columns: list with the columns to read, all of them by default
+        :param start_date: first date to read, ISO string or date, included
+        :param end_date: last date to read, ISO string or date, included
+        :param include_rejected: whether the rejected listings are read as well
+        :return: generator of maps with the snapshot rows, in the order they were written
+        """
+        if columns is not None:
+            # The status is always needed to leave the rejected listings out
+            columns = list(dict.fromkeys(list(columns) + ['status']))
+        for path in self._get_snapshot_files(start_date, end_date):
+            if path.endswith('.parquet'):
+                rows = self._read_parquet(path, columns)
+            else:
+                rows = self._read_jsonl(path)
+            for row in rows:
+                if include_rejected or row.get('status') == 'valid':
+                    yield row
+
+    def _get_snapshot_files(self, start_date, end_date):
+        if not os.path.isdir(self._directory):
+            return []
+        start_date = str(start_date) if start_date is not None else None
+        end_date = str(end_date) if end_date is not None else None
+        paths = []
+        for partition in sorted(os.listdir(self._directory)):
+            if not partition.startswith('date='):
+                continue
+            # The ISO dates sort as strings
+            partition_date = partition[len('date='):]
+            if (start_date is not None and partition_date < start_date) or (end_date is not None and partition_date > end_date):
+                continue
+            partition_directory = os.path.join(self._directory, partition)
+            paths.extend(os.path.join(partition_directory, file_name)
+                         for file_name in sorted(os.listdir(partition_directory))
+                         if file_name.endswith('.parquet') or file_name.endswith('.jsonl.gz'))
+        return paths
+
+    @staticmethod
+    def _read_parquet(path, columns):
+        import pyarrow.parquet as pq
+
+        return pq.read_table(path, columns=columns).to_pylist()
+
+    @staticmethod
+    def _read_jsonl(path):
+        with gzip.open(path, 'rt', encoding='utf-8') as snapshot_file:
+            for line in snapshot_file:
+                yield json.loads(line)
+
+    def get_rent_per_sqm_by_quarter(self, period='month', rent_field='cold_rent', start_date=None, end_date=None):
+        """
+        Rent per square meter of the listings on the market by quarter and period. A listing seen by many runs of
+        the same period is counted once, with its last values.
+
+        :param period: day, week or month
+        :param rent_field: cold_rent or hot_rent
+        :param start_date: first date, ISO string or date, included
+        :param end_date: last date, ISO string or date, included
+        :return: map of quarters to maps of periods to the median and mean rent per square meter and the listings
+        """
+        get_period = self._get_period_function(period)
+        values = {}
+        for row in self.iterate_rows(['run_at', 'id', 'quarter', 'size', rent_field], start_date, end_date):
+            rent, size = row.get(rent_field), row.get('size')
+            if not rent or not size or size <= 0:
+                continue
+            values[(row['quarter'], get_period(row['run_at']), row['id'])] = rent / size
+
+        grouped_values = defaultdict(lambda: defaultdict(list))
+        for (quarter, period_key, _), rent_per_sqm in values.items():
+            grouped_values[quarter][period_key].append(rent_per_sqm)
+        return {
+            quarter: {
+                period_key: {
+                    'median': round(statistics.median(period_values), 2),
+                    'mean': round(statistics.mean(period_values), 2),
+                    'listings': len(period_values)
+                }
+                for period_key, period_values in sorted(periods.items())
+            }
+            for quarter, periods in sorted(grouped_values.items(), key=lambda item: str(item[0]))
+        }
+
+    def get_time_on_market(self, start_date=None, end_date=None):
+        """
+        Days between the publication of the listings and the last run that saw them, by quarter. The listings seen by
+        the last run are still on the market, so their time is a lower bound.
+
+        :param start_date: first date, ISO string or date, included
+        :param end_date: last date, ISO string or date, included
+        :return: map of quarters to maps with the median and mean days, the listings and the ones still active
+        """
+        listings = {}
+        last_run_at = None
+        for row in self.iterate_rows(['run_at', 'id', 'quarter', 'publish_date'], start_date, end_date):
+            listing = listings.get(row['id'])
+            if listing is None:
+                listing = listings[row['id']] = {'quarter': row['quarter'], 'publish_date': row['publish_date'],
+                                                 'first_seen': row['run_at']}
+            listing['last_seen'] = row['run_at']
+            if last_run_at is None or row['run_at'] > last_run_at:
+                last_run_at = row['run_at']
+
+        grouped_days = defaultdict(list)
+        active_listings = defaultdict(int)
+        for listing in listings.values():
+            # The listings without publish date are on the market since the first run that saw them
+            published_at = self._parse_datetime(listing['publish_date']) or self._parse_datetime(listing['first_seen'])
+            days = (self._parse_datetime(listing['last_seen']) - published_at).total_seconds() / 86400
+            grouped_days[listing['quarter']].append(max(0.0, days))
+            if listing['last_seen'] == last_run_at:
+                active_listings[listing['quarter']] += 1
+        return {
+            quarter: {
+                'median_days': round(statistics.median(days), 1),
+                'mean_days': round(statistics.mean(days), 1),
+                'listings': len(days),
+                'active': active_listings[quarter]
+            }
+            for quarter, days in sorted(grouped_days.items(), key=lambda item: str(item[0]))
+        }
+
+    @staticmethod
+    def _get_period_function(period):
+        if period == 'day':
+            return lambda run_at: run_at[:10]
+        if period == 'month':
+            return lambda run_at: run_at[:7]
+        if period == 'week':
+            def get_week(run_at):
+                year, week, _ = datetime.date.fromisoformat(run_at[:10]).isocalendar()
+                return f'{year}-W{week:02d}'
+            return get_week
+        raise ValueError(f'The period {period} is not supported')
+
+    @staticmethod
+    def _parse_datetime(value):
+        if not value:
+            return None
+        # Only the local date and time are used, the offsets of the publish dates do not matter for days
+        try:
+            return datetime.datetime.fromisoformat(str(value)[:19])
+        except ValueError:
+            return None
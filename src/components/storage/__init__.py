@@ -0,0 +1,3 @@
+"""
+The local storage components
+"""
\ No newline at end of file
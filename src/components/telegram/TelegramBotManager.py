@@ -1,5 +1,6 @@
-import requests
 from enum import Enum
+from urllib.parse import quote
+from src.components.telegram.TelegramDispatcher import TelegramDispatcher
 
 
 class RequestType(Enum):
@@ -12,6 +13,7 @@ class TelegramBotManager:
     _bot_token = None
     _bot_chat_id = None
     _base_url = 'https://api.telegram.org/bot'
+    _dispatcher = None
 
     def __init__(self, configuration):
         """
@@ -26,21 +28,34 @@ class TelegramBotManager:
             self._bot_chat_id = configuration['bot_chat_id']
         if 'base_url' in configuration:
             self._base_url = configuration['base_url']
+        self._dispatcher = TelegramDispatcher(configuration.get('dispatcher', {}))
+
+    def set_rate_limiter(self, rate_limiter):
+        self._dispatcher.set_rate_limiter(rate_limiter)
 
     # Supports only markdown for now
     def _build_request(self, request_type, args ):
         if request_type == RequestType.SEND_MESSAGE:
             method_name = 'sendMessage'
-            message = args['text_message']
+            message = quote(args['text_message'])
             chat_id = args['chat_id']
             base_url = f'{self._base_url}{self._bot_token}/{method_name}?chat_id={chat_id}&parse_mode=Markdown&text={message}'
             return base_url
         else:
             raise ValueError(f'The value {request_type} is not valid')
 
-    # Bulkified for the user but use one by one for now.
     def send_text_message_to_users(self, message, chat_ids=None):
-        responses = []
+        return self.wait_for_messages(self.send_text_message_to_users_async(message, chat_ids))
+
+    def send_text_message_to_users_async(self, message, chat_ids=None):
+        """
+        Queues the message for every chat in the dispatcher without waiting for the responses
+
+        :param message: markdown text to send
+        :param chat_ids: comma separated chat ids, the configured chat by default
+        :return: list of futures with the responses
+        """
+        futures = []
         chat_id_list = chat_ids.split(',') if chat_ids else [self._bot_chat_id]
         for chat_id in chat_id_list:
             request_args = {
@@ -48,6 +63,9 @@ class TelegramBotManager:
                 'chat_id': chat_id
             }
             request_url = self._build_request(RequestType.SEND_MESSAGE, request_args)
-            response = requests.get(request_url)
-            responses.append(response)
-        return responses
+            futures.append(self._dispatcher.submit(chat_id, request_url))
+        return futures
+
+    @staticmethod
+    def wait_for_messages(futures):
+        return [future.result() for future in futures]
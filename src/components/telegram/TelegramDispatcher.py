@@ -0,0 +1,97 @@
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from src.commons.TokenBucket import TokenBucket
+
+
+class TelegramDispatcher:
+    """
+    Sends the bot requests concurrently over a pooled session. Telegram limits are honoured with a global token
+    bucket and one bucket per chat, and the 429 responses are retried after the given retry_after.
+    """
+
+    _max_workers = 8
+    _global_rate = 30
+    _chat_rate = 1
+    _max_retries = 3
+
+    _configuration = None
+    _session = None
+    _executor = None
+    _global_bucket = None
+    _chat_buckets = None
+    _chat_buckets_lock = None
+    _rate_limiter = None
+
+    def __init__(self, configuration):
+        """
+        Constructor using standard a configuation map
+
+        :param configuration:
+        """
+        self._configuration = configuration
+        if 'max_workers' in configuration:
+            self._max_workers = configuration['max_workers']
+        if 'global_rate' in configuration:
+            self._global_rate = configuration['global_rate']
+        if 'chat_rate' in configuration:
+            self._chat_rate = configuration['chat_rate']
+        if 'max_retries' in configuration:
+            self._max_retries = configuration['max_retries']
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._max_workers)
+        self._session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='telegram')
+        self._global_bucket = TokenBucket(self._global_rate)
+        self._chat_buckets = {}
+        self._chat_buckets_lock = threading.Lock()
+
+    def set_rate_limiter(self, rate_limiter):
+        """
+        :param rate_limiter: object with an acquire method shared with other dispatchers, e.g. by the coordinator, it
+                             is honoured on top of the own buckets
+        """
+        self._rate_limiter = rate_limiter
+
+    def submit(self, chat_id, request_url):
+        """
+        Queues the request to be sent to the given chat
+
+        :param chat_id: the chat the request is addressed to, used for the per chat limit
+        :param request_url: the full bot request url
+        :return: a future with the response
+        """
+        return self._executor.submit(self._send, chat_id, request_url)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _get_chat_bucket(self, chat_id):
+        with self._chat_buckets_lock:
+            if chat_id not in self._chat_buckets:
+                self._chat_buckets[chat_id] = TokenBucket(self._chat_rate, 1)
+            return self._chat_buckets[chat_id]
+
+    def _send(self, chat_id, request_url):
+        response = None
+        for attempt in range(self._max_retries + 1):
+            self._get_chat_bucket(chat_id).acquire()
+            self._global_bucket.acquire()
+            if self._rate_limiter is not None:
+                self._rate_limiter.acquire()
+            response = self._session.get(request_url)
+            if response.status_code != 429:
+                return response
+            retry_after = self._get_retry_after(response)
+            print(f'WARNING:: Telegram rate limit reached for chat {chat_id}, retrying in {retry_after} seconds')
+            time.sleep(retry_after)
+        return response
+
+    @staticmethod
+    def _get_retry_after(response):
+        try:
+            return response.json()['parameters']['retry_after']
+        except (ValueError, KeyError, TypeError):
+            return 1
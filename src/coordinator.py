@@ -0,0 +1,156 @@
+import json
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from src.commons.SharedRateLimiter import SharedRateLimiter
+from src.main import build_configuration
+from src.pipelines.process_apartment_data import ApartmentIntegrationPipeline
+
+
+def load_tenants(tenants_file):
+    """
+    Reads the tenants file, a JSON list where every tenant has a name and the environment variables that differ from
+    the ones of the coordinator, e.g. {"name": "anna", "environment": {"SHEET_ID": "...", "SEARCH_URLS": "...",
+    "CHAT_IDS": "..."}}. The variables are the same ones main.py reads.
+
+    :param tenants_file: path of the JSON file
+    :return: map of tenant names to their environment
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    with open(tenants_file) as json_file:
+        tenants = json.load(json_file)
+    tenant_environments = {}
+    for tenant in tenants:
+        name = tenant['name']
+        # Many processes cannot listen on the same metrics port
+        environment = {key: value for key, value in os.environ.items() if key != 'METRICS_PORT'}
+        # Every tenant keeps its own store and page fingerprints
+        environment['LISTING_DB_FILE'] = f'{root}/listings-{name}.db'
+        environment['SEARCH_CACHE_DIRECTORY'] = f'{root}/.search_cache/{name}'
+        if 'SNAPSHOT_DIRECTORY' in os.environ:
+            environment['SNAPSHOT_DIRECTORY'] = os.path.join(os.environ['SNAPSHOT_DIRECTORY'], name)
+        environment.update({key: str(value) for key, value in tenant.get('environment', {}).items()})
+        tenant_environments[name] = environment
+    return tenant_environments
+
+
+def get_search_urls(environment):
+    return environment.get('SEARCH_URLS', environment.get('SEARCH_URL', '')).split()
+
+
+def build_shards(tenant_environments, number_of_workers):
+    """
+    Groups the tenants that share any search url, so the shared pages are fetched once inside one worker, and
+    spreads the groups over the workers balancing their number of distinct searches
+
+    :param tenant_environments: map of tenant names to their environment
+    :param number_of_workers: maximum number of shards
+    :return: list of shards, every shard is a list of tenant names
+    """
+    group_of = {name: name for name in tenant_environments}
+
+    def find_group(name):
+        while group_of[name] != name:
+            group_of[name] = group_of[group_of[name]]
+            name = group_of[name]
+        return name
+
+    url_tenants = {}
+    for name, environment in tenant_environments.items():
+        for url in get_search_urls(environment):
+            if url in url_tenants:
+                group_of[find_group(name)] = find_group(url_tenants[url])
+            else:
+                url_tenants[url] = name
+
+    groups = defaultdict(list)
+    for name in tenant_environments:
+        groups[find_group(name)].append(name)
+
+    def count_searches(group):
+        return len({url for name in group for url in get_search_urls(tenant_environments[name])})
+
+    shards = [[] for _ in range(min(number_of_workers, len(groups)))]
+    shard_searches = [0] * len(shards)
+    for group in sorted(groups.values(), key=count_searches, reverse=True):
+        index = shard_searches.index(min(shard_searches))
+        shards[index].extend(group)
+        shard_searches[index] += count_searches(group)
+    return shards
+
+
+def build_pipeline(name, environment, rate_limiters, in_memory):
+    """
+    :return: the pipeline of the tenant, or None when it could not be built, e.g. the token could not be refreshed
+    """
+    try:
+        configuration = build_configuration(environment)
+        configuration['ListingStore']['in_memory'] = in_memory
+        pipeline = ApartmentIntegrationPipeline(configuration)
+    except Exception as error:
+        print(f'ERROR:: The pipeline of the tenant {name} could not be built: {error}')
+        return None
+    pipeline.set_rate_limiters(rate_limiters)
+    return pipeline
+
+
+def run_worker(tenant_environments, rate_limiters, interval_seconds):
+    """
+    Runs the pipelines of a shard, once or every interval. The pipelines are built once so their services, sessions
+    and stores stay warm between the rounds, the ones that could not be built are tried again on the next round.
+
+    :param tenant_environments: map of tenant names to their environment
+    :param rate_limiters: the limiters shared by all the workers, see ApartmentIntegrationPipeline.set_rate_limiters
+    :param interval_seconds: seconds between rounds, or None to run a single round
+    """
+    pipelines = {}
+    while True:
+        started_at = time.monotonic()
+        # The pages fetched in the round are shared by the tenants of the shard
+        shared_responses = {}
+        for name, environment in tenant_environments.items():
+            if name not in pipelines:
+                pipeline = build_pipeline(name, environment, rate_limiters, interval_seconds is not None)
+                if pipeline is None:
+                    continue
+                pipelines[name] = pipeline
+            pipeline = pipelines[name]
+            print(f'INFO:: Running the pipeline of the tenant {name}')
+            pipeline.set_shared_responses(shared_responses)
+            try:
+                pipeline.execute()
+            except Exception as error:
+                print(f'ERROR:: The pipeline of the tenant {name} failed: {error}')
+        if interval_seconds is None:
+            return
+        time.sleep(max(0, interval_seconds - (time.monotonic() - started_at)))
+
+
+def run_coordinator():
+    root = os.path.dirname(os.path.abspath(__file__))
+    tenant_environments = load_tenants(os.environ.get('TENANTS_FILE', root + '/tenants.json'))
+    number_of_workers = int(os.environ.get('COORDINATOR_WORKERS', str(os.cpu_count() or 1)))
+    interval_seconds = int(os.environ['COORDINATOR_INTERVAL_SECONDS']) if 'COORDINATOR_INTERVAL_SECONDS' in os.environ else None
+    # The limits are global for all the workers, they all go out through the same IP
+    rate_limiters = {
+        'immo': SharedRateLimiter(float(os.environ.get('IMMO_RATE_LIMIT', '2'))),
+        'sheets': SharedRateLimiter(float(os.environ.get('SHEETS_RATE_LIMIT', '1'))),
+        'telegram': SharedRateLimiter(float(os.environ.get('TELEGRAM_RATE_LIMIT', '30')))
+    }
+
+    shards = build_shards(tenant_environments, number_of_workers)
+    print(f'INFO:: Running {len(tenant_environments)} tenants in {len(shards)} worker processes')
+    workers = []
+    for index, shard in enumerate(shards):
+        shard_environments = {name: tenant_environments[name] for name in shard}
+        worker = multiprocessing.Process(target=run_worker, name=f'shard-{index}',
+                                         args=(shard_environments, rate_limiters, interval_seconds))
+        worker.start()
+        workers.append(worker)
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == '__main__':
+    run_coordinator()
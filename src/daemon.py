@@ -0,0 +1,37 @@
+import datetime
+import os
+import pytz
+from apscheduler.schedulers.blocking import BlockingScheduler
+from src.main import build_configuration
+from src.pipelines.process_apartment_data import ApartmentIntegrationPipeline
+
+
+def execute_pipeline(pipeline):
+    # A failed run must not stop the daemon, the next tick will try again
+    try:
+        pipeline.execute()
+    except Exception as error:
+        print(f'ERROR:: The pipeline execution failed: {error}')
+
+
+def run_daemon():
+    interval_seconds = int(os.environ.get('DAEMON_INTERVAL_SECONDS', '300'))
+    jitter_seconds = int(os.environ.get('DAEMON_JITTER_SECONDS', '30'))
+    configuration = build_configuration()
+    # The known ids are kept in memory between runs
+    configuration['ListingStore']['in_memory'] = True
+    # The pipeline is built once so the Sheets service, the sessions and the known ids stay warm
+    pipeline = ApartmentIntegrationPipeline(configuration)
+
+    # APScheduler only supports pytz timezones, the local zone detected by tzlocal is not one
+    scheduler = BlockingScheduler(timezone=pytz.utc)
+    scheduler.add_job(
+        execute_pipeline, 'interval', args=[pipeline], seconds=interval_seconds, jitter=jitter_seconds,
+        max_instances=1, coalesce=True, next_run_time=datetime.datetime.now(pytz.utc)
+    )
+    print(f'INFO:: Running the pipeline every {interval_seconds} seconds with up to {jitter_seconds} seconds of jitter')
+    scheduler.start()
+
+
+if __name__ == '__main__':
+    run_daemon()
@@ -0,0 +1,87 @@
+import json
+import os
+import shutil
+import time
+
+# Only the standard library is imported here, the pipeline and its clients are imported by the first invocation.
+# Everything kept in the module scope survives the warm invocations of the same container.
+_module_loaded_at = time.perf_counter()
+_pipeline = None
+_invocations = 0
+
+# The package is read only in Lambda, /tmp is the only writable directory
+_writable_directory = os.environ.get('LAMBDA_WRITABLE_DIRECTORY', '/tmp')
+
+
+def _get_writable_copy(path):
+    """
+    Copies a packaged file into the writable directory once, so it can be updated, e.g. a refreshed token
+
+    :param path: the packaged file
+    :return: the path of the writable copy
+    """
+    writable_path = os.path.join(_writable_directory, os.path.basename(path))
+    if not os.path.exists(writable_path) and os.path.exists(path):
+        shutil.copyfile(path, writable_path)
+    return writable_path
+
+
+def _build_pipeline():
+    from src.main import build_configuration
+    from src.pipelines.process_apartment_data import ApartmentIntegrationPipeline
+
+    configuration = build_configuration()
+    configuration['ListingStore']['db_file'] = os.environ.get(
+        'LISTING_DB_FILE', os.path.join(_writable_directory, 'listings.db')
+    )
+    # The ids are mirrored in memory while the container is warm
+    configuration['ListingStore']['in_memory'] = True
+    configuration['ImmoManager']['response_cache']['cache_directory'] = os.environ.get(
+        'SEARCH_CACHE_DIRECTORY', os.path.join(_writable_directory, '.search_cache')
+    )
+    if 'snapshots' in configuration:
+        snapshot_directory = os.path.abspath(configuration['snapshots']['directory'])
+        if not os.access(snapshot_directory if os.path.isdir(snapshot_directory) else os.path.dirname(snapshot_directory), os.W_OK):
+            # The history in /tmp only lives as long as the container, e.g. a mounted EFS keeps it
+            configuration['snapshots']['directory'] = os.path.join(_writable_directory, 'snapshots')
+    sheet_configuration = configuration['GoogleSheetManager']
+    # The refresh token is packaged, the refreshed access token is stored in the writable copy
+    sheet_configuration['token_file'] = _get_writable_copy(sheet_configuration['token_file'])
+    if not os.path.exists(sheet_configuration['discovery_cache_file']):
+        sheet_configuration['discovery_cache_file'] = os.path.join(_writable_directory, 'sheets_discovery.json')
+    sheet_configuration['interactive_auth'] = False
+    # The container is frozen once the handler returns, the alerts cannot be left in the background
+    configuration['wait_for_alerts'] = True
+    return ApartmentIntegrationPipeline(configuration)
+
+
+def handler(event, context):
+    """
+    Lambda entry point, runs the pipeline once. The pipeline is built by the first invocation of the container and
+    reused by the warm ones, with its Sheets service, sessions and known ids.
+
+    :param event: the invocation event, unused
+    :param context: the Lambda context, unused
+    :return: map with the timings of the invocation and the metrics of the run
+    """
+    global _pipeline, _invocations
+    started_at = time.perf_counter()
+    cold_start = _pipeline is None
+    if cold_start:
+        _pipeline = _build_pipeline()
+    initialized_at = time.perf_counter()
+    _pipeline.execute()
+    finished_at = time.perf_counter()
+    _invocations += 1
+
+    timings = {
+        'cold_start': cold_start,
+        'invocation': _invocations,
+        # Time since the module was imported, it includes the runtime start on cold starts
+        'since_module_load_seconds': round(finished_at - _module_loaded_at, 6),
+        'init_seconds': round(initialized_at - started_at, 6),
+        'execution_seconds': round(finished_at - initialized_at, 6),
+        'total_seconds': round(finished_at - started_at, 6)
+    }
+    print(f'METRICS:: {json.dumps(timings)}')
+    return dict(timings, metrics=_pipeline.get_run_metrics())
@@ -1,32 +1,95 @@
+import json
 import os
 from src.pipelines.process_apartment_data import ApartmentIntegrationPipeline
 
 
-def find_apartments():
+def build_configuration(environment=None):
+    """
+    Builds the pipeline configuration from the environment variables
+
+    :param environment: map of the variables, the process environment by default
+    :return: the configuration map
+    """
+    environment = os.environ if environment is None else environment
     root = os.path.dirname(os.path.abspath(__file__))
-    pipeline = ApartmentIntegrationPipeline({
-        'sheet_range': 'Listado!B2:S',
+    searches = environment.get('SEARCH_URLS', environment.get('SEARCH_URL', '')).split()
+    configuration = {
+        'sheet_range': 'Listado!B2:V',
+        # The incremental crawl expects the search to be sorted by newest first (sorting=2)
+        'incremental': environment.get('INCREMENTAL_CRAWL', 'false').lower() == 'true',
+        # The incremental crawl also stops on the listings published before the newest one seen by their search
+        'high_water_mark': environment.get('INCREMENTAL_HIGH_WATER_MARK', 'false').lower() == 'true',
+        # Many searches can be given separated by whitespace, they are crawled together and deduplicated
+        'searches': searches,
+        'reconcile': environment.get('RECONCILE_SHEET', 'false').lower() == 'true',
+        # The changes of the known listings are written in place and alerted when they become interesting
+        'track_changes': environment.get('TRACK_CHANGES', 'false').lower() == 'true',
+        'realert_on_change': environment.get('REALERT_ON_CHANGE', 'false').lower() == 'true',
+        'metrics': {
+            'prometheus_port': int(environment['METRICS_PORT']) if 'METRICS_PORT' in environment else None
+        },
+        'ListingStore': {
+            'db_file': environment.get('LISTING_DB_FILE', root + '/listings.db')
+        },
         'GoogleSheetManager': {
-            'sheet_id': os.environ['SHEET_ID'],
+            'sheet_id': environment['SHEET_ID'],
             'token_file': root + '/token.json',
-            'credentials_file': root + '/credentials.json'
+            'credentials_file': root + '/credentials.json',
+            'discovery_cache_file': root + '/sheets_discovery.json',
+            # Unattended runs, e.g. the Lambda handler, must fail instead of waiting for a browser login
+            'interactive_auth': environment.get('GOOGLE_INTERACTIVE_AUTH', 'true').lower() == 'true'
         },
         'ImmoManager': {
-            'first_url': os.environ['SEARCH_URL'],
+            'first_url': environment.get('SEARCH_URL', searches[0]),
+            'max_workers': int(environment.get('SEARCH_MAX_WORKERS', '4')),
+            'response_cache': {
+                'cache_directory': environment.get('SEARCH_CACHE_DIRECTORY', root + '/.search_cache'),
+                'ttl_seconds': int(environment.get('SEARCH_CACHE_TTL_SECONDS', '60'))
+            },
+            'skip_unchanged_pages': True,
             'filters':{
                 'include_exchange': False,
-                'include_wbs': False
+                'include_wbs': False,
+                'min_pictures': 5
             }
         },
         'TelegramBotManager': {
-            'bot_token': os.environ['BOT_TOKEN'],
-            'bot_chat_id': os.environ['BOT_CHAT_ID'],
-            'chat_ids': os.environ['CHAT_IDS']
+            'bot_token': environment['BOT_TOKEN'],
+            'bot_chat_id': environment['BOT_CHAT_ID'],
+            'chat_ids': environment['CHAT_IDS']
         },
+        # Every chat in CHAT_IDS is alerted with the default rule unless the rules file assigns it others
         'notification_filters':{
-            'rent': 400
+            'rules': {
+                'default': [
+                    {'field': 'score', 'op': '>', 'value': 400},
+                    {'field': 'distance_center', 'op': '<=', 'value': 4},
+                    {'field': 'hot_rent', 'op': '<', 'value': 1200}
+                ]
+            }
         }
-    })
+    }
+    if 'GOOGLE_SERVICE_ACCOUNT_FILE' in environment:
+        configuration['GoogleSheetManager']['service_account_file'] = environment['GOOGLE_SERVICE_ACCOUNT_FILE']
+    if 'NOTIFICATION_RULES_FILE' in environment:
+        # Map with the rules and the chats keys, see ApartmentIntegrationPipeline._compile_alert_rules
+        with open(environment['NOTIFICATION_RULES_FILE']) as rules_file:
+            configuration['notification_filters'] = json.load(rules_file)
+    if 'LOCATION_CONFIG_FILE' in environment:
+        # Points of interest, location features and geocoding table, see LocationScorer
+        with open(environment['LOCATION_CONFIG_FILE']) as location_file:
+            configuration['ImmoManager']['location'] = json.load(location_file)
+    if 'SNAPSHOT_DIRECTORY' in environment:
+        # History of every processed listing for the market analytics, see SnapshotExporter
+        configuration['snapshots'] = {
+            'directory': environment['SNAPSHOT_DIRECTORY'],
+            'format': environment.get('SNAPSHOT_FORMAT', 'auto')
+        }
+    return configuration
+
+
+def find_apartments():
+    pipeline = ApartmentIntegrationPipeline(build_configuration())
     pipeline.execute()
 
 
@@ -3,23 +3,54 @@ import json
 from src.components.immo.ImmoManager import ImmoManager
 from src.components.gcp.gdrive.GoogleSheetManager import GoogleSheetManager
 from src.commons.DataManipulationUtils import DataManipulationUtils
+from src.commons.MetricsCollector import MetricsCollector
+from src.commons.RuleEngine import RuleEngine
 from src.components.telegram.TelegramBotManager import TelegramBotManager
+from src.components.storage.ListingStore import ListingStore
+from src.components.storage.SnapshotExporter import SnapshotExporter
 
 
 class ApartmentIntegrationPipeline:
 
     _processed_entries = None
+    _previous_entries = None
     _append_entries = None
+    _realert_entries = None
+    _new_entries_count = 0
     _notification_status = None
     _immo_manager = None
     _gsheet_manager = None
     _telegram_bot = None
+    _listing_store = None
+    _snapshot_exporter = None
+    _snapshot_failed = False
+    _metrics = None
 
     _configuration = None
     _sheet_range = None
+    _incremental = False
+    _high_water_mark = False
+    _reconcile = False
+    _wait_for_alerts = True
+    _streaming = False
+    _stream_batch_size = 100
+    _track_changes = False
+    _realert_on_change = False
     _gsheet_manager_conf = None
     _immo_manager_conf = None
     _telegram_bot_conf = None
+    _listing_store_conf = None
+    _snapshot_conf = None
+    _alert_rules = None
+    _alert_chat_ids = None
+    # Alert rule used for every chat when no notification rules are configured
+    _default_alert_rules = {
+        'default': [
+            {'field': 'score', 'op': '>', 'value': 400},
+            {'field': 'distance_center', 'op': '<=', 'value': 4},
+            {'field': 'hot_rent', 'op': '<', 'value': 1200}
+        ]
+    }
 
     def __init__(self, configuration):
         """
@@ -30,53 +61,401 @@ class ApartmentIntegrationPipeline:
         self._configuration = configuration
         if 'sheet_range' in configuration:
             self._sheet_range = configuration['sheet_range']
+        if 'incremental' in configuration:
+            self._incremental = configuration['incremental']
+        if 'high_water_mark' in configuration:
+            self._high_water_mark = configuration['high_water_mark']
+        if 'reconcile' in configuration:
+            self._reconcile = configuration['reconcile']
+        if 'wait_for_alerts' in configuration:
+            self._wait_for_alerts = configuration['wait_for_alerts']
+        if 'streaming' in configuration:
+            self._streaming = configuration['streaming']
+        if 'stream_batch_size' in configuration:
+            self._stream_batch_size = configuration['stream_batch_size']
+        if 'track_changes' in configuration:
+            self._track_changes = configuration['track_changes']
+        if 'realert_on_change' in configuration:
+            self._realert_on_change = configuration['realert_on_change']
         self._gsheet_manager_conf = configuration['GoogleSheetManager']
         self._immo_manager_conf = configuration['ImmoManager']
+        if 'searches' in configuration:
+            # Every search is crawled by the same manager so the listings shared by many searches are processed once
+            self._immo_manager_conf = dict(self._immo_manager_conf, search_urls=configuration['searches'])
+        if 'snapshots' in configuration:
+            self._snapshot_conf = configuration['snapshots']
+            # The snapshots keep the rejected listings too, with their reason. Every listing on the market has to be
+            # processed on every run, so the unchanged pages are not skipped and the crawl does not stop early.
+            self._immo_manager_conf = dict(self._immo_manager_conf, keep_rejected=True, skip_unchanged_pages=False)
+            if self._incremental:
+                print('WARNING:: The snapshots need the whole search on every run, the incremental crawl is disabled')
+                self._incremental = False
+            self._snapshot_exporter = SnapshotExporter(self._snapshot_conf)
         self._telegram_bot_conf = configuration['TelegramBotManager']
-        self._telegram_bot = TelegramBotManager(self._telegram_bot_conf)
-        self._sheet_manager = GoogleSheetManager(self._gsheet_manager_conf)
-        self._immo_manager = ImmoManager(self._immo_manager_conf)
+        self._telegram_bot = self._create_telegram_bot(self._telegram_bot_conf)
+        self._compile_alert_rules(configuration.get('notification_filters', {}))
+        self._sheet_manager = self._create_sheet_manager(self._gsheet_manager_conf)
+        self._immo_manager = self._create_immo_manager(self._immo_manager_conf)
+        if 'ListingStore' in configuration:
+            self._listing_store_conf = configuration['ListingStore']
+            self._listing_store = ListingStore(self._listing_store_conf)
+        if self._high_water_mark and self._listing_store is None:
+            # The newest publish date of every search is kept by the store
+            print('WARNING:: The high-water mark needs a ListingStore, it is disabled')
+            self._high_water_mark = False
+        if self._track_changes and self._listing_store is None:
+            # The previous content of the listings is only kept by the store
+            print('WARNING:: The change tracking needs a ListingStore, it is disabled')
+            self._track_changes = False
+        self._metrics = MetricsCollector(configuration.get('metrics', {}))
+        self._immo_manager.set_metrics(self._metrics)
+
+    def _compile_alert_rules(self, configuration):
+        """
+        Compiles the alert rules and assigns them to the chats. The rules are a map of rule names to conditions, see
+        RuleEngine, and the chats a map of chat ids to the rule name or list of rule names they follow. The configured
+        chat_ids of the bot that are not in the map follow the default rule.
+
+        :param configuration: the notification_filters map with the rules and chats keys
+        """
+        rules = configuration.get('rules', self._default_alert_rules)
+        chats = dict(configuration.get('chats', {}))
+        bot_chat_ids = self._telegram_bot_conf.get('chat_ids') or self._telegram_bot_conf.get('bot_chat_id') or ''
+        for chat_id in str(bot_chat_ids).split(','):
+            if chat_id and chat_id not in chats and 'default' in rules:
+                chats[chat_id] = 'default'
+        self._alert_rules = RuleEngine(rules)
+        # Every rule keeps its chats, so an entry is evaluated once for all of them
+        self._alert_chat_ids = {rule_name: set() for rule_name in rules}
+        for chat_id, rule_names in chats.items():
+            for rule_name in [rule_names] if isinstance(rule_names, str) else rule_names:
+                if rule_name not in self._alert_chat_ids:
+                    raise ValueError(f'The chat {chat_id} follows the rule {rule_name} which is not defined')
+                self._alert_chat_ids[rule_name].add(str(chat_id))
+
+    # The components are created through these methods so they can be replaced, e.g. by the offline benchmarks
+    def _create_telegram_bot(self, configuration):
+        return TelegramBotManager(configuration)
+
+    def _create_sheet_manager(self, configuration):
+        return GoogleSheetManager(configuration)
+
+    def _create_immo_manager(self, configuration):
+        return ImmoManager(configuration)
+
+    def set_rate_limiters(self, rate_limiters):
+        """
+        Limits the requests of the components, e.g. with limiters shared by many pipelines
+
+        :param rate_limiters: map with the optional immo, sheets and telegram limiters, objects with an acquire method
+        """
+        if 'immo' in rate_limiters:
+            self._immo_manager.set_rate_limiter(rate_limiters['immo'])
+        if 'sheets' in rate_limiters:
+            self._sheet_manager.set_rate_limiter(rate_limiters['sheets'])
+        if 'telegram' in rate_limiters:
+            self._telegram_bot.set_rate_limiter(rate_limiters['telegram'])
+
+    def get_run_metrics(self):
+        return self._metrics.to_dict()
+
+    def set_shared_responses(self, shared_responses):
+        self._immo_manager.set_shared_responses(shared_responses)
 
     def execute(self):
-        self._extract_apartment_data()
-        self._load_data_to_sheets()
-        if self._append_entries:
-            self._send_alerts_for_best_apartments()
-        self._notify_process_metadata()
+        # The pipeline can be executed many times by the daemon, so nothing is kept from the previous run
+        self._processed_entries = None
+        self._append_entries = None
+        self._realert_entries = {}
+        self._new_entries_count = 0
+        self._notification_status = None
+        self._immo_manager.reset_counters()
+        # The sheet may have been edited since the previous run
+        self._sheet_manager.clear_table_cache()
+        self._metrics.reset()
+        if self._snapshot_exporter is not None:
+            self._snapshot_exporter.start_run()
+            self._snapshot_failed = False
+        with self._metrics.stage('total'):
+            if self._listing_store is not None:
+                self._sync_listing_store()
+            if self._streaming:
+                self._execute_streaming()
+            else:
+                self._extract_apartment_data()
+                self._load_data_to_sheets()
+                self._new_entries_count = len(self._append_entries) if self._append_entries else 0
+                if self._append_entries or self._realert_entries:
+                    with self._metrics.stage('alerts'):
+                        self._send_alerts_for_best_apartments()
+            # Everything is stored, the next run can skip the pages that do not change
+            self._immo_manager.commit_page_fingerprints()
+            if self._listing_store is not None:
+                self._listing_store.set_high_water_dates(self._immo_manager.pop_newest_publish_dates())
+            self._immo_manager.save_location_data()
+            if self._snapshot_exporter is not None:
+                self._write_snapshot()
+            self._notify_process_metadata()
+        self._metrics.increment('new_entries', self._new_entries_count)
+        self._metrics.log_json()
+
+    def _execute_streaming(self):
+        """
+        Streams the pages through the pipeline: every page is deduplicated as it arrives and the new entries are
+        buffered, once the buffer is full they are appended to the sheet and alerted. Only the known ids and one
+        buffer are kept in memory, and the first alerts go out while the later pages are still being downloaded.
+        """
+        if self._listing_store is not None:
+            known_ids = self._listing_store
+        else:
+            previous_entries = self._get_previous_entries()
+            known_ids = set(previous_entries.keys()) if previous_entries else set()
+        is_empty_sheet = len(known_ids) == 0
+        futures = []
+        buffer = {}
+        with self._metrics.stage('stream'):
+            pages = self._immo_manager.iterate_processed_pages(known_ids=known_ids if self._incremental else None,
+                                                               high_water_date=self._get_high_water_dates())
+            for page_entries in pages:
+                if self._snapshot_exporter is not None:
+                    self._add_snapshot_listings(page_entries.values())
+                unknown_ids = self._get_unknown_ids(known_ids, page_entries.keys())
+                for entry_id in unknown_ids:
+                    buffer[entry_id] = page_entries[entry_id]
+                if self._track_changes and len(unknown_ids) < len(page_entries):
+                    unknown_ids = set(unknown_ids)
+                    known_entries = {entry_id: entry for entry_id, entry in page_entries.items()
+                                     if entry_id not in unknown_ids}
+                    realert_entries = self._update_changed_entries(known_entries)
+                    if realert_entries:
+                        with self._metrics.stage('alerts'):
+                            futures.extend(self._queue_alert_messages(realert_entries.values()))
+                if len(buffer) >= self._stream_batch_size:
+                    futures.extend(self._flush_stream_buffer(buffer, known_ids, is_empty_sheet))
+                    is_empty_sheet = False
+                    buffer = {}
+            if buffer:
+                futures.extend(self._flush_stream_buffer(buffer, known_ids, is_empty_sheet))
+        print(f'DEBUG:: Found {self._new_entries_count} new entries in the new batch')
+        self._wait_for_alert_responses(futures)
+
+    def _get_unknown_ids(self, known_ids, entry_ids):
+        if self._listing_store is not None:
+            return self._listing_store.get_unknown_ids(entry_ids)
+        return [entry_id for entry_id in entry_ids if entry_id not in known_ids]
+
+    def _flush_stream_buffer(self, buffer, known_ids, is_empty_sheet):
+        with self._metrics.stage('sheet_write'):
+            if is_empty_sheet:
+                first_row = self._sheet_manager.set_table_data_from_map_array(self._sheet_range, list(buffer.values()))
+            else:
+                first_row = self._sheet_manager.append_table_data_from_map_array(self._sheet_range, list(buffer.values()))
+            if self._listing_store is not None:
+                self._listing_store.add_entries(buffer.values(), first_row=first_row)
+            else:
+                known_ids.update(buffer.keys())
+        self._new_entries_count += len(buffer)
+        with self._metrics.stage('alerts'):
+            return self._queue_alerts(buffer)
 
     def _extract_apartment_data(self):
-        processed_entries = self._immo_manager.get_processed_search_results()
+        self._previous_entries = None
+        if self._incremental and self._listing_store is not None:
+            with self._metrics.stage('extract'):
+                processed_entries = self._immo_manager.get_processed_search_results(
+                    known_ids=self._listing_store, high_water_date=self._get_high_water_dates()
+                )
+        elif self._incremental:
+            # The known ids are needed upfront so the crawl can stop on the first already known page
+            self._previous_entries = self._get_previous_entries()
+            known_ids = set(self._previous_entries.keys()) if self._previous_entries else set()
+            with self._metrics.stage('extract'):
+                processed_entries = self._immo_manager.get_processed_search_results(known_ids=known_ids)
+        else:
+            with self._metrics.stage('extract'):
+                processed_entries = self._immo_manager.get_processed_search_results()
         self._processed_entries = processed_entries
+        if self._snapshot_exporter is not None:
+            self._add_snapshot_listings(processed_entries.values())
+
+    def _add_snapshot_listings(self, listings):
+        if self._snapshot_failed:
+            return
+        with self._metrics.stage('snapshot'):
+            try:
+                self._snapshot_exporter.add_listings(listings)
+                self._snapshot_exporter.add_rejected(self._immo_manager.pop_rejected_entries())
+            except OSError as error:
+                self._drop_snapshot(error)
+
+    def _write_snapshot(self):
+        self._add_snapshot_listings([])
+        if self._snapshot_failed:
+            return
+        with self._metrics.stage('snapshot'):
+            try:
+                self._snapshot_exporter.write_run()
+            except OSError as error:
+                self._drop_snapshot(error)
+
+    def _drop_snapshot(self, error):
+        # The history is only for the analytics, the run itself goes on without it
+        print(f'WARNING:: The snapshot of the run could not be written: {error}')
+        self._snapshot_failed = True
+        try:
+            self._snapshot_exporter.start_run()
+        except OSError:
+            pass
+
+    def _get_high_water_dates(self):
+        # Listings published at or before the newest one seen by their search count as known, even when they are not
+        # stored. The searches are kept apart, an old listing of a search can be new in another one.
+        if self._incremental and self._high_water_mark:
+            return self._listing_store.get_high_water_dates()
+        return None
+
+    def _sync_listing_store(self):
+        # The sheet is only read to bootstrap the store or when a reconcile is explicitly requested
+        if self._reconcile or len(self._listing_store) == 0:
+            with self._metrics.stage('sheet_read'):
+                data = self._sheet_manager.iterate_table_columns(self._sheet_range, ['id', 'publish_date'],
+                                                                 include_row_number=True)
+                self._listing_store.reconcile(data)
+
+    def _get_previous_entries(self):
+        # Only the ids are needed to find the new entries
+        with self._metrics.stage('sheet_read'):
+            data = list(self._sheet_manager.iterate_table_columns(self._sheet_range, ['id']))
+        return DataManipulationUtils.create_indexed_map_from_map_array(data, 'id') if len(data) > 0 else []
 
     def _load_data_to_sheets(self):
-        data = self._sheet_manager.get_table_data_as_map_array(self._sheet_range)
-        previous_entries = DataManipulationUtils.create_indexed_map_from_map_array(data, 'id') if len(data) > 0 else []
+        if self._listing_store is not None:
+            self._load_new_data_to_sheets_with_store()
+            return
+
+        previous_entries = self._previous_entries if self._previous_entries is not None else self._get_previous_entries()
 
         if len(previous_entries) > 0:
-            previous_keys = previous_entries.keys()
-            current_keys = self._processed_entries.keys()
-            append_entries = {}
-            for current_key in current_keys:
-                if current_key not in previous_keys:
-                    append_entries[current_key] = self._processed_entries[current_key]
+            with self._metrics.stage('diff'):
+                previous_keys = previous_entries.keys()
+                current_keys = self._processed_entries.keys()
+                append_entries = {}
+                for current_key in current_keys:
+                    if current_key not in previous_keys:
+                        append_entries[current_key] = self._processed_entries[current_key]
             print(f'DEBUG:: Found {len(append_entries)} new entries in the new batch')
             if append_entries:
-                self._sheet_manager.append_table_data_from_map_array(self._sheet_range, list(append_entries.values()))
+                with self._metrics.stage('sheet_write'):
+                    self._sheet_manager.append_table_data_from_map_array(self._sheet_range, list(append_entries.values()))
                 self._append_entries = append_entries
             return
 
         # In case of no previous entries
-        self._sheet_manager.set_table_data_from_map_array(self._sheet_range, list(self._processed_entries.values()))
+        with self._metrics.stage('sheet_write'):
+            self._sheet_manager.set_table_data_from_map_array(self._sheet_range, list(self._processed_entries.values()))
         self._append_entries = self._processed_entries
 
+    def _load_new_data_to_sheets_with_store(self):
+        # An empty store means an empty sheet, so the header has to be written as well
+        is_empty_sheet = len(self._listing_store) == 0
+        with self._metrics.stage('diff'):
+            new_ids = self._listing_store.get_unknown_ids(self._processed_entries.keys())
+            append_entries = {entry_id: self._processed_entries[entry_id] for entry_id in new_ids}
+        print(f'DEBUG:: Found {len(append_entries)} new entries in the new batch')
+        if self._track_changes and len(append_entries) < len(self._processed_entries):
+            known_entries = {entry_id: entry for entry_id, entry in self._processed_entries.items()
+                             if entry_id not in append_entries}
+            self._realert_entries = self._update_changed_entries(known_entries)
+        if not append_entries:
+            return
+
+        with self._metrics.stage('sheet_write'):
+            if is_empty_sheet:
+                first_row = self._sheet_manager.set_table_data_from_map_array(self._sheet_range, list(append_entries.values()))
+            else:
+                first_row = self._sheet_manager.append_table_data_from_map_array(self._sheet_range, list(append_entries.values()))
+            self._listing_store.add_entries(append_entries.values(), first_row=first_row)
+        self._append_entries = append_entries
+
+    def _update_changed_entries(self, entries):
+        """
+        Updates in the sheet only the cells of the tracked fields that changed since the listings were stored.
+
+        :param entries: map of processed entries that are already in the sheet
+        :return: map of the changed entries that crossed the alert rules of some chat to the tuple (entry, chat ids),
+                 when re-alerting is enabled
+        """
+        realert_entries = {}
+        with self._metrics.stage('change_tracking'):
+            changed_entries = self._listing_store.detect_changes(entries.values())
+            updates = []
+            for entry, row_number, changes in self._verify_rows(changed_entries):
+                print(f'DEBUG:: The entry {entry["id"]} changed: {changes}')
+                self._metrics.increment('changed_entries')
+                if row_number is None:
+                    print(f'WARNING:: The entry {entry["id"]} is not in the sheet anymore, its changes are not written')
+                    continue
+                updates.extend((row_number, field, entry[field]) for field in changes)
+                if not self._realert_on_change:
+                    continue
+                # Only the chats whose rules did not hold before the change are alerted
+                previous_entry = dict(entry, **{field: values[0] for field, values in changes.items()})
+                chat_ids = self._get_alert_chat_ids(entry) - self._get_alert_chat_ids(previous_entry)
+                if chat_ids:
+                    realert_entries[entry['id']] = (entry, chat_ids)
+            if updates:
+                self._metrics.increment('updated_cells', self._sheet_manager.update_table_cells(self._sheet_range, updates))
+        return realert_entries
+
+    def _verify_rows(self, changed_entries):
+        """
+        Checks that the stored rows still hold the changed listings before their cells are written. The sheet is edited
+        by hand, e.g. sorted or with deleted rows, so on any mismatch the rows of the store are read again from the id
+        column of the sheet.
+
+        :param changed_entries: list of (entry, row_number, changes) as returned by ListingStore.detect_changes
+        :return: the same list with the current row numbers, None for the listings that are not in the sheet
+        """
+        row_numbers = [row_number for entry, row_number, changes in changed_entries if row_number is not None]
+        with self._metrics.stage('sheet_read'):
+            cells = self._sheet_manager.get_column_cells(self._sheet_range, 'id', row_numbers) if row_numbers else {}
+        if all(row_number is not None and str(cells.get(row_number)) == str(entry['id'])
+               for entry, row_number, changes in changed_entries):
+            return changed_entries
+
+        print('WARNING:: The sheet rows do not match the listing store, the rows are read again from the sheet')
+        self._metrics.increment('relocated_stores')
+        with self._metrics.stage('sheet_read'):
+            sheet_rows = {str(row['id']): row['row_number'] for row in self._sheet_manager.iterate_table_columns(
+                self._sheet_range, ['id'], include_row_number=True)}
+        self._listing_store.relocate({'id': entry_id, 'row_number': row_number}
+                                     for entry_id, row_number in sheet_rows.items())
+        return [(entry, sheet_rows.get(str(entry['id'])), changes) for entry, row_number, changes in changed_entries]
+
     def _send_alerts_for_best_apartments(self):
-        responses = []
-        notification_entry_ids = set()
-        for entry in self._append_entries.values():
-            if entry['score'] > 400 and entry['distance_center'] <= 4 and entry['hot_rent'] < 1200:
-                notification_entry_ids.add(entry['id'])
-        for entry_id in notification_entry_ids:
-            entry = self._append_entries[entry_id]
+        futures = self._queue_alerts(self._append_entries or {})
+        futures.extend(self._queue_alert_messages(self._realert_entries.values()))
+        self._wait_for_alert_responses(futures)
+
+    def _get_alert_chat_ids(self, entry):
+        chat_ids = set()
+        for rule_name in self._alert_rules.match(entry):
+            chat_ids.update(self._alert_chat_ids[rule_name])
+        return chat_ids
+
+    def _queue_alerts(self, entries):
+        return self._queue_alert_messages((entry, self._get_alert_chat_ids(entry)) for entry in entries.values())
+
+    def _queue_alert_messages(self, alerts):
+        """
+        :param alerts: iterable of tuples (entry, chat ids to alert)
+        :return: list of futures with the responses
+        """
+        futures = []
+        for entry, chat_ids in alerts:
+            if not chat_ids:
+                continue
+            entry_id = entry['id']
             hot_rent = entry['hot_rent']
             size = entry['size']
             distance_center = entry['distance_center']
@@ -94,14 +473,23 @@ class ApartmentIntegrationPipeline:
             message += f'You can find more info at {url} and the location in {maps_url} \n'
 
             # Send messages 1 by 1 because it the text is too long it will failed.
-            responses.append(self._telegram_bot.send_text_message_to_users(message, self._telegram_bot_conf['chat_ids']))
+            futures.extend(self._telegram_bot.send_text_message_to_users_async(message, ','.join(sorted(chat_ids))))
 
-        self._notification_status = responses
+        return futures
+
+    def _wait_for_alert_responses(self, futures):
+        if not self._wait_for_alerts:
+            # The dispatcher keeps sending in the background, the process will wait for it before exiting
+            print(f'INFO:: {len(futures)} alerts dispatched in the background')
+            self._notification_status = None
+            return
+        self._notification_status = self._telegram_bot.wait_for_messages(futures)
+        self._metrics.increment('alerts_sent', len(self._notification_status))
 
     def _notify_process_metadata(self):
         message = f'These are the results of the process at {str(datetime.datetime.now())} \n'
         message += f'There were {self._immo_manager.total_success} success, {self._immo_manager.total_exchange} exchange offers and {self._immo_manager.total_wbs} WBS from a total of {self._immo_manager.total_entries} entries \n'
-        message += f'Found {len(self._append_entries) if self._append_entries else 0} new entries in the new batch \n'
+        message += f'Found {self._new_entries_count} new entries in the new batch \n'
         if self._notification_status:
             for response in self._notification_status:
                 message += f'The responses to the notification is: ' \
@@ -0,0 +1,59 @@
+import pytest
+from benchmarks.StandIns import InMemorySheetsService, OfflineGoogleSheetManager
+from src.components.gcp.gdrive.GoogleSheetManager import GoogleSheetManager
+
+
+@pytest.mark.parametrize('sheet_range, expected', [
+    ('Listado!B2:V', ('Listado', 'B', 2, 'V')),
+    ('Listado!B2:V100', ('Listado', 'B', 2, 'V')),
+    ('Listado!AA10', ('Listado', 'AA', 10, 'AA')),
+    ('B:D', ('Sheet1', 'B', 1, 'D')),
+    ("'My listings'!C3:Z", ("'My listings'", 'C', 3, 'Z')),
+])
+def test_parse_range(sheet_range, expected):
+    assert GoogleSheetManager._parse_range(sheet_range) == expected
+
+
+@pytest.mark.parametrize('sheet_range', ['b2:v', 'Listado!', 'Listado!2:5'])
+def test_parse_range_rejects_unsupported_ranges(sheet_range):
+    with pytest.raises(ValueError):
+        GoogleSheetManager._parse_range(sheet_range)
+
+
+@pytest.mark.parametrize('column, index', [('A', 1), ('B', 2), ('Z', 26), ('AA', 27), ('AZ', 52), ('BA', 53),
+                                           ('ZZ', 702), ('AAA', 703)])
+def test_column_conversion(column, index):
+    assert GoogleSheetManager._column_to_index(column) == index
+    assert GoogleSheetManager._index_to_column(index) == column
+
+
+def test_column_conversion_round_trip():
+    for index in range(1, 20000):
+        assert GoogleSheetManager._column_to_index(GoogleSheetManager._index_to_column(index)) == index
+
+
+def build_sheet_manager(rows, **configuration):
+    return OfflineGoogleSheetManager(dict({'service': InMemorySheetsService(rows)}, **configuration))
+
+
+def test_iterate_table_columns_reads_past_short_chunks():
+    rows = [['id', 'publish_date', 'title']] + [[str(number), '2021-09-12', 'Flat'] for number in range(1, 26)]
+    # The API trims the empty cells at the end of every column, so this chunk comes back with only 7 rows
+    for index in (8, 9, 10):
+        rows[index] = ['', '', '']
+    sheet_manager = build_sheet_manager(rows, read_chunk_size=10)
+
+    table_rows = list(sheet_manager.iterate_table_columns('Listado!B2:D', ['id'], include_row_number=True))
+
+    assert [row['id'] for row in table_rows] == [str(number) for number in range(1, 26) if number not in (8, 9, 10)]
+    assert table_rows[0]['row_number'] == 3
+    assert table_rows[-1] == {'id': '25', 'row_number': 27}
+
+
+def test_get_column_cells():
+    rows = [['title', 'id'], ['Flat', '10'], ['Flat', ''], ['Flat', '30']]
+    sheet_manager = build_sheet_manager(rows)
+
+    assert sheet_manager.get_column_cells('Listado!B2:C', 'id', [5, 3, 4, 9]) == {3: '10', 4: '', 5: '30', 9: ''}
+    with pytest.raises(ValueError):
+        sheet_manager.get_column_cells('Listado!B2:C', 'missing', [3])
@@ -0,0 +1,119 @@
+import datetime
+import pytest
+from src.components.storage.ListingStore import ListingStore
+
+
+@pytest.fixture(params=[False, True], ids=['database', 'in_memory'])
+def listing_store(request):
+    listing_store = ListingStore({'db_file': ':memory:', 'in_memory': request.param,
+                                  'tracked_fields': ['score', 'hot_rent', 'title']})
+    yield listing_store
+    listing_store.close()
+
+
+def build_entry(entry_id, score=100.0, hot_rent=900.0, title='Flat', publish_date='2021-09-12T10:00:00.000+02:00'):
+    return {'id': entry_id, 'score': score, 'hot_rent': hot_rent, 'title': title, 'publish_date': publish_date}
+
+
+def test_unknown_ids_keep_the_input_order(listing_store):
+    listing_store.add_entries([build_entry('2'), build_entry(4)])
+
+    assert listing_store.get_unknown_ids([5, '4', 1, '2', 3]) == ['5', '1', '3']
+    assert len(listing_store) == 2
+    assert '4' in listing_store and 4 in listing_store and '5' not in listing_store
+
+
+def test_unknown_ids_are_looked_up_in_chunks(listing_store):
+    listing_store._lookup_chunk_size = 7
+    listing_store.add_entries(build_entry(number) for number in range(0, 100, 2))
+
+    assert listing_store.get_unknown_ids(range(100)) == [str(number) for number in range(1, 100, 2)]
+
+
+def test_known_entries_are_not_stored_again(listing_store):
+    listing_store.add_entries([build_entry('1')], first_row=3)
+    listing_store.add_entries([build_entry('1', score=1.0), build_entry('2')], first_row=10)
+
+    assert len(listing_store) == 2
+    # The first row and state of the listing are kept
+    assert listing_store.detect_changes([build_entry('1')]) == []
+
+
+def test_detect_changes(listing_store):
+    listing_store.add_entries([build_entry('1'), build_entry('2'), build_entry('3')], first_row=3)
+
+    changed_entries = listing_store.detect_changes([build_entry('1'), build_entry('2', hot_rent=950.0, title='New'),
+                                                    build_entry('9')])
+
+    assert [(entry['id'], row_number, changes) for entry, row_number, changes in changed_entries] == [
+        ('2', 4, {'hot_rent': (900.0, 950.0), 'title': ('Flat', 'New')})
+    ]
+    # The new state is stored, the same values are not reported twice
+    assert listing_store.detect_changes([build_entry('2', hot_rent=950.0, title='New')]) == []
+
+
+def test_reconcile_resets_the_content_state(listing_store):
+    listing_store.add_entries([build_entry('1'), build_entry('2')], first_row=3)
+
+    listing_store.reconcile([{'id': '2', 'publish_date': '', 'row_number': 7}, {'id': '5', 'row_number': 8}])
+
+    assert listing_store.get_unknown_ids(['1', '2', '5']) == ['1']
+    # Only the state is stored the first time a listing is seen after a reconcile
+    assert listing_store.detect_changes([build_entry('2', score=1.0)]) == []
+    changed_entries = listing_store.detect_changes([build_entry('2', score=2.0)])
+    assert [(entry['id'], row_number) for entry, row_number, changes in changed_entries] == [('2', 7)]
+
+
+def test_relocate_keeps_the_content_state(listing_store):
+    listing_store.add_entries([build_entry('1'), build_entry('2')], first_row=3)
+
+    listing_store.relocate([{'id': '2', 'row_number': 3}])
+
+    changed_entries = listing_store.detect_changes([build_entry('1', score=1.0), build_entry('2', score=2.0)])
+    assert [(entry['id'], row_number) for entry, row_number, changes in changed_entries] == [('1', None), ('2', 3)]
+
+
+def test_high_water_marks_are_kept_per_search(listing_store):
+    listing_store.set_high_water_dates({'search_a': '2021-09-12T10:00:00.000+02:00',
+                                        'search_b': '2021-09-01T10:00:00.000+02:00',
+                                        'search_c': 'not a date'})
+    listing_store.set_high_water_dates({'search_a': '2021-09-10T10:00:00.000+02:00',
+                                        'search_b': '2021-09-05T10:00:00.000+02:00'})
+
+    high_water_dates = listing_store.get_high_water_dates()
+
+    assert set(high_water_dates.keys()) == {'search_a', 'search_b'}
+    # The marks never go back
+    assert high_water_dates['search_a'] == datetime.datetime(2021, 9, 12, 8, tzinfo=datetime.timezone.utc)
+    assert high_water_dates['search_b'] == datetime.datetime(2021, 9, 5, 8, tzinfo=datetime.timezone.utc)
+
+
+def test_high_water_marks_are_compared_as_datetimes(listing_store):
+    # 00:45 after the end of the summer time is later than 01:30 before it, although it sorts first as a string
+    listing_store.set_high_water_dates({'search': '2021-10-31T01:30:00.000+02:00'})
+    listing_store.set_high_water_dates({'search': '2021-10-31T00:45:00.000+01:00'})
+
+    assert listing_store.get_high_water_dates()['search'] == datetime.datetime(2021, 10, 30, 23, 45,
+                                                                               tzinfo=datetime.timezone.utc)
+
+
+def test_reconcile_drops_the_high_water_marks(listing_store):
+    listing_store.set_high_water_dates({'search': '2021-09-12T10:00:00.000+02:00'})
+
+    listing_store.reconcile([{'id': '1'}])
+
+    assert listing_store.get_high_water_dates() == {}
+
+
+def test_the_store_is_durable(tmp_path):
+    db_file = str(tmp_path / 'listings.db')
+    listing_store = ListingStore({'db_file': db_file})
+    listing_store.add_entries([build_entry('1')], first_row=3)
+    listing_store.set_high_water_dates({'search': '2021-09-12T10:00:00.000+02:00'})
+    listing_store.close()
+
+    listing_store = ListingStore({'db_file': db_file, 'in_memory': True})
+
+    assert listing_store.get_unknown_ids(['1', '2']) == ['2']
+    assert list(listing_store.get_high_water_dates().keys()) == ['search']
+    listing_store.close()
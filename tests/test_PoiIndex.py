@@ -0,0 +1,83 @@
+import random
+import pytest
+from haversine import haversine
+from src.components.location.PoiIndex import PoiIndex
+
+
+def build_points(number_of_points, seed=42):
+    # Berlin and its surroundings, with a few clusters so some cells are crowded and most are empty
+    generator = random.Random(seed)
+    points = []
+    for index in range(number_of_points):
+        if index % 3 == 0:
+            latitude, longitude = generator.gauss(52.52, 0.01), generator.gauss(13.40, 0.015)
+        else:
+            latitude, longitude = generator.uniform(52.3, 52.7), generator.uniform(13.0, 13.8)
+        points.append((latitude, longitude, generator.choice(['station', 'school']), f'point {index}'))
+    return points
+
+
+def build_queries(number_of_queries, seed=7):
+    generator = random.Random(seed)
+    # Some queries fall outside of the indexed area
+    return [(generator.uniform(52.2, 52.8), generator.uniform(12.8, 14.0)) for _ in range(number_of_queries)]
+
+
+@pytest.fixture(scope='module', params=[0.5, 1.0, 3.0], ids=lambda cell_size: f'cell_{cell_size}km')
+def indexed_points(request):
+    points = build_points(300)
+    poi_index = PoiIndex({'cell_size_km': request.param})
+    for latitude, longitude, category, name in points:
+        poi_index.add_point(latitude, longitude, category, name)
+    return poi_index, points
+
+
+def brute_force_nearest(points, latitude, longitude, category, max_distance_km=None):
+    distances = [(haversine((latitude, longitude), (point_latitude, point_longitude)), name)
+                 for point_latitude, point_longitude, point_category, name in points if point_category == category]
+    if not distances:
+        return None, None
+    distance, name = min(distances, key=lambda item: item[0])
+    if max_distance_km is not None and distance > max_distance_km:
+        return None, None
+    return distance, name
+
+
+@pytest.mark.parametrize('max_distance_km', [None, 0.5, 2, 50])
+def test_nearest_matches_a_brute_force_scan(indexed_points, max_distance_km):
+    poi_index, points = indexed_points
+    for latitude, longitude in build_queries(100):
+        for category in ('station', 'school'):
+            expected_distance, _ = brute_force_nearest(points, latitude, longitude, category, max_distance_km)
+            distance, name = poi_index.nearest(latitude, longitude, category, max_distance_km)
+            # Two points can be at the same distance, only the distance has to be the same
+            assert distance == expected_distance
+            assert (name is None) == (expected_distance is None)
+
+
+@pytest.mark.parametrize('radius_km', [0.2, 1, 2.5, 10])
+def test_count_within_matches_a_brute_force_scan(indexed_points, radius_km):
+    poi_index, points = indexed_points
+    for latitude, longitude in build_queries(100):
+        for category in ('station', 'school'):
+            expected_count = sum(1 for point_latitude, point_longitude, point_category, name in points
+                                 if point_category == category
+                                 and haversine((latitude, longitude), (point_latitude, point_longitude)) <= radius_km)
+            assert poi_index.count_within(latitude, longitude, category, radius_km) == expected_count
+
+
+def test_unknown_category(indexed_points):
+    poi_index, points = indexed_points
+
+    assert poi_index.nearest(52.52, 13.40, 'office') == (None, None)
+    assert poi_index.count_within(52.52, 13.40, 'office', 5) == 0
+
+
+def test_point_on_the_query_position():
+    poi_index = PoiIndex({})
+    poi_index.add_point(52.52, 13.40, 'office', 'hq')
+
+    assert poi_index.nearest(52.52, 13.40, 'office') == (0.0, 'hq')
+    assert poi_index.count_within(52.52, 13.40, 'office', 0) == 1
+    assert len(poi_index) == 1
+    assert poi_index.get_categories() == ['office']
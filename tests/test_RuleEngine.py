@@ -0,0 +1,99 @@
+import pytest
+from src.commons.RuleEngine import RuleEngine
+
+
+class RecordingValues(dict):
+    """
+    Map that records every field read, so the tests can see which conditions were evaluated
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reads = []
+
+    def __getitem__(self, key):
+        self.reads.append(key)
+        return super().__getitem__(key)
+
+
+def test_cheap_conditions_are_evaluated_first():
+    engine = RuleEngine({'rule': [{'field': 'title', 'op': 'contains', 'value': 'wbs'},
+                                  {'field': 'tags', 'op': 'in', 'value': ['a']},
+                                  {'field': 'score', 'op': '>', 'value': 400}]})
+    values = RecordingValues(title='WBS required', tags='a', score=500)
+
+    assert engine.match(values) == ['rule']
+    assert values.reads == ['score', 'tags', 'title']
+
+
+def test_failed_cheap_condition_skips_the_expensive_ones():
+    engine = RuleEngine({'rule': [{'field': 'title', 'op': 'contains', 'value': 'wbs'},
+                                  {'field': 'score', 'op': '>', 'value': 400}]})
+    values = RecordingValues(title='WBS required', score=100)
+
+    assert engine.first_match(values) is None
+    assert values.reads == ['score']
+
+
+def test_nested_fields_cost_more_than_flat_ones():
+    engine = RuleEngine({'rule': [{'field': 'address.quarter', 'op': '==', 'value': 'Mitte'},
+                                  {'field': 'score', 'op': '>', 'value': 400}]})
+    values = RecordingValues(address={'quarter': 'Mitte'}, score=100)
+
+    assert engine.match(values) == []
+    assert values.reads == ['score']
+
+
+def test_shared_conditions_are_evaluated_once():
+    engine = RuleEngine({'first': [{'field': 'score', 'op': '>', 'value': 400},
+                                   {'field': 'size', 'op': '<', 'value': 10}],
+                         'second': [{'field': 'score', 'op': '>', 'value': 400},
+                                    {'field': 'size', 'op': '>=', 'value': 10}]})
+    values = RecordingValues(score=500, size=50)
+
+    assert engine.match(values) == ['second']
+    assert values.reads.count('score') == 1
+
+
+def test_first_match_follows_the_declaration_order_and_not_the_cost():
+    engine = RuleEngine({'expensive': [{'field': 'title', 'op': 'contains', 'value': 'wbs'}],
+                         'cheap': [{'field': 'score', 'op': '>', 'value': 400}]})
+    values = {'title': 'WBS required', 'score': 500}
+
+    assert engine.first_match(values) == 'expensive'
+    assert engine.match(values) == ['expensive', 'cheap']
+    assert engine.get_rule_names() == ['expensive', 'cheap']
+
+
+def test_first_match_stops_on_the_first_rule_that_holds():
+    engine = RuleEngine({'first': [{'field': 'score', 'op': '>', 'value': 400}],
+                         'second': [{'field': 'title', 'op': 'contains', 'value': 'wbs'}]})
+    values = RecordingValues(title='WBS required', score=500)
+
+    assert engine.first_match(values) == 'first'
+    assert values.reads == ['score']
+
+
+@pytest.mark.parametrize('condition, expected', [
+    ({'field': 'title', 'op': 'contains', 'value': 'WBS'}, True),
+    ({'field': 'title', 'op': 'not_contains', 'value': 'wbs'}, False),
+    ({'field': 'quarter', 'op': 'in', 'value': ['Mitte', 'Wedding']}, True),
+    ({'field': 'quarter', 'op': 'not_in', 'value': ['Mitte']}, False),
+    ({'field': 'score', 'op': '<=', 'value': 500}, True),
+    ({'field': 'score', 'op': '!=', 'value': 500}, False),
+    ({'field': 'address.postcode', 'op': '==', 'value': '10115'}, True),
+    # Missing fields and values that cannot be compared never hold
+    ({'field': 'missing', 'op': 'not_contains', 'value': 'wbs'}, False),
+    ({'field': 'address.missing.deeper', 'op': '==', 'value': 1}, False),
+    ({'field': 'title', 'op': '>', 'value': 1}, False),
+])
+def test_operators(condition, expected):
+    engine = RuleEngine({'rule': [condition]})
+    values = {'title': 'Nice flat, wbs required', 'quarter': 'Mitte', 'score': 500, 'address': {'postcode': '10115'}}
+
+    assert (engine.first_match(values) == 'rule') is expected
+
+
+def test_unknown_operator_is_rejected():
+    with pytest.raises(ValueError):
+        RuleEngine({'rule': [{'field': 'score', 'op': 'between', 'value': [1, 2]}]})